@@ -2,9 +2,53 @@
 import pandas as pd
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
-from scipy.sparse import csr_matrix
+from scipy.sparse import csr_matrix, diags
 import json
 import os
+import threading
+import time
+import weakref
+
+from als_model import (
+    DEFAULT_ALS_ALPHA,
+    DEFAULT_ALS_FACTORS,
+    DEFAULT_ALS_ITERATIONS,
+    DEFAULT_ALS_REGULARIZATION,
+    ALSModel
+)
+from model_cache import file_fingerprint, file_stats, write_bundle
+
+# Các file nguồn ratings
+COMMENTS_FILE = "restaurant_comments.json"
+REVIEWS_FILE = "restaurants_reviews_new.json"
+PREFERENCES_FILE = "user_preferences.json"
+RATING_SOURCES = [COMMENTS_FILE, REVIEWS_FILE, PREFERENCES_FILE]
+
+# Nguồn được fingerprint trong bundle: user_preferences.json đổi sau mỗi
+# lần xem / like nên không tính, dòng current_user được fold-in lúc load
+CF_BUNDLE_SOURCES = [COMMENTS_FILE, REVIEWS_FILE]
+
+# Số láng giềng giữ lại cho mỗi restaurant (None = giữ tất cả)
+DEFAULT_CF_NEIGHBORS = 50
+
+# Chỉ giữ các cặp có similarity lớn hơn ngưỡng này
+DEFAULT_CF_MIN_SIMILARITY = 0.0
+
+# Số phần tử tối đa của một block similarity (items × block) khi train
+CF_BLOCK_ELEMENTS = 4_000_000
+
+# Backend CF (đổi bằng biến môi trường CF_BACKEND):
+# - 'neighbors': item-based CF trên similarity top-k
+# - 'als': matrix factorization ALS (als_model.py), rating là implicit feedback
+# - 'als-explicit': ALS khớp trực tiếp giá trị rating
+CF_BACKEND = os.environ.get('CF_BACKEND', 'neighbors')
+
+# Bundle model đã train nằm cạnh file reviews:
+# restaurants_reviews_new.json -> restaurants_reviews_new.cfmodel/
+CF_BUNDLE_SUFFIX = '.cfmodel'
+
+# Tăng khi đổi định dạng bundle (bundle cũ bị coi là hết hạn)
+CF_BUNDLE_VERSION = 1
 
 
 # =======================
@@ -20,9 +64,9 @@ def load_user_ratings():
     ratings_data = []
 
     # 1. Load từ user comments
-    if os.path.exists("restaurant_comments.json"):
+    if os.path.exists(COMMENTS_FILE):
         try:
-            with open("restaurant_comments.json", 'r', encoding='utf-8') as f:
+            with open(COMMENTS_FILE, 'r', encoding='utf-8') as f:
                 comments = json.load(f)
 
             for res_id, comments_list in comments.items():
@@ -37,9 +81,9 @@ def load_user_ratings():
             pass
 
     # 2. Load từ Foody reviews
-    if os.path.exists("restaurants_reviews_new.json"):
+    if os.path.exists(REVIEWS_FILE):
         try:
-            with open("restaurants_reviews_new.json", 'r', encoding='utf-8') as f:
+            with open(REVIEWS_FILE, 'r', encoding='utf-8') as f:
                 reviews = json.load(f)
 
             for review in reviews:
@@ -53,31 +97,13 @@ def load_user_ratings():
             pass
 
     # 3. Load từ user preferences (liked restaurants)
-    if os.path.exists("user_preferences.json"):
-        try:
-            with open("user_preferences.json", 'r', encoding='utf-8') as f:
-                prefs = json.load(f)
-
-            # Liked restaurants = rating 9
-            for res_id in prefs.get('liked_restaurants', []):
-                ratings_data.append({
-                    'user_id': 'current_user',
-                    'restaurant_id': res_id,
-                    'rating': 9,
-                    'source': 'preference'
-                })
-
-            # Viewed restaurants = rating 6
-            for res_id in prefs.get('viewed_restaurants', [])[-10:]:  # 10 gần nhất
-                if res_id not in prefs.get('liked_restaurants', []):
-                    ratings_data.append({
-                        'user_id': 'current_user',
-                        'restaurant_id': res_id,
-                        'rating': 6,
-                        'source': 'preference'
-                    })
-        except:
-            pass
+    for res_id, rating in load_preference_ratings().items():
+        ratings_data.append({
+            'user_id': 'current_user',
+            'restaurant_id': res_id,
+            'rating': rating,
+            'source': 'preference'
+        })
 
     if not ratings_data:
         return pd.DataFrame(columns=['user_id', 'restaurant_id', 'rating'])
@@ -90,29 +116,78 @@ def load_user_ratings():
     return df
 
 
+def load_preference_ratings():
+    """
+    preference_ratings của file user_preferences.json (rỗng nếu chưa có / lỗi)
+    """
+    if not os.path.exists(PREFERENCES_FILE):
+        return {}
+
+    try:
+        with open(PREFERENCES_FILE, 'r', encoding='utf-8') as f:
+            return preference_ratings(json.load(f))
+    except:
+        return {}
+
+
+def preference_ratings(prefs):
+    """
+    Rating của current_user suy ra từ user preferences:
+    liked restaurants = 9, 10 quán xem gần nhất (chưa like) = 6
+
+    Returns:
+        Dict restaurant_id -> rating
+    """
+    liked = prefs.get('liked_restaurants', [])
+
+    ratings = {}
+    for res_id in prefs.get('viewed_restaurants', [])[-10:]:  # 10 gần nhất
+        if res_id not in liked:
+            ratings[res_id] = 6
+    for res_id in liked:
+        ratings[res_id] = 9
+    return ratings
+
+
 # =======================
 # Build User-Item Matrix
 # =======================
 def build_user_item_matrix(ratings_df):
     """
-    Tạo ma trận User-Item từ ratings
+    Tạo ma trận User-Item sparse trực tiếp từ các bộ ba (user, restaurant, rating),
+    không tạo pivot table dense users × restaurants
     Rows: Users, Columns: Restaurants
+
+    User / restaurant id được mã hóa thành chỉ số int32 liên tục (sort tăng dần
+    như pivot_table); nhiều rating cùng (user, restaurant) được lấy trung bình.
+
+    Returns:
+        (csr_matrix float32 users × restaurants, user_ids, item_ids)
+        hoặc (None, None, None) nếu không có rating
     """
     if ratings_df.empty:
         return None, None, None
 
-    # Tạo pivot table
-    user_item_matrix = ratings_df.pivot_table(
-        index='user_id',
-        columns='restaurant_id',
-        values='rating',
-        fill_value=0
-    )
+    user_codes, user_ids = pd.factorize(ratings_df['user_id'].astype(str), sort=True)
+    item_codes, item_ids = pd.factorize(ratings_df['restaurant_id'].astype(np.int64), sort=True)
+    n_users, n_items = len(user_ids), len(item_ids)
+
+    # Gộp các cặp trùng: key = user · n_items + item, đã sort theo (user, item)
+    keys = user_codes.astype(np.int64) * n_items + item_codes
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    sums = np.bincount(inverse, weights=ratings_df['rating'].to_numpy(dtype=np.float64))
+    counts = np.bincount(inverse)
 
-    # Convert to sparse matrix để tiết kiệm memory
-    sparse_matrix = csr_matrix(user_item_matrix.values)
+    rows = (unique_keys // n_items).astype(np.int32)
+    indptr = np.zeros(n_users + 1, dtype=np.int32)
+    np.cumsum(np.bincount(rows, minlength=n_users), out=indptr[1:])
+
+    sparse_matrix = csr_matrix(
+        ((sums / counts).astype(np.float32), (unique_keys % n_items).astype(np.int32), indptr),
+        shape=(n_users, n_items)
+    )
 
-    return user_item_matrix, sparse_matrix, user_item_matrix.index, user_item_matrix.columns
+    return sparse_matrix, np.asarray(user_ids, dtype=object), np.asarray(item_ids, dtype=np.int64)
 
 
 # =======================
@@ -120,128 +195,354 @@ def build_user_item_matrix(ratings_df):
 # =======================
 def calculate_user_similarity(user_item_matrix):
     """
-    Tính similarity giữa các users
+    Tính similarity giữa các users (sparse users × users)
     """
     if user_item_matrix is None:
         return None
 
-    # Cosine similarity giữa users
-    user_similarity = cosine_similarity(user_item_matrix.values)
-
-    return pd.DataFrame(
-        user_similarity,
-        index=user_item_matrix.index,
-        columns=user_item_matrix.index
-    )
+    # Cosine similarity giữa users, giữ dạng sparse
+    return cosine_similarity(user_item_matrix, dense_output=False)
 
 
 # =======================
 # Item-Based CF
 # =======================
-def calculate_item_similarity(user_item_matrix):
+def calculate_item_similarity(user_item_matrix, k=DEFAULT_CF_NEIGHBORS,
+                              min_similarity=DEFAULT_CF_MIN_SIMILARITY, block_size=None):
     """
-    Tính similarity giữa các items (restaurants)
+    Tính similarity giữa các items (restaurants), chỉ giữ top-k láng giềng
+
+    Cosine được tính sparse × sparse theo từng block cột: block j là
+    items × block (chỉ có các cặp từng được cùng một user rate), lấy top-k
+    mỗi cột rồi bỏ block đi -> bộ nhớ / thời gian theo số cặp co-rated,
+    không theo restaurants².
+
+    Args:
+        user_item_matrix: csr_matrix users × restaurants
+        k: Số láng giềng giữ lại cho mỗi restaurant (None = giữ tất cả)
+        min_similarity: Chỉ giữ similarity > ngưỡng này
+        block_size: Số cột mỗi block (mặc định tự tính theo CF_BLOCK_ELEMENTS)
+
+    Returns:
+        csr_matrix float32 restaurants × restaurants: dòng i là các láng giềng
+        của restaurant i (không gồm chính nó)
     """
     if user_item_matrix is None:
         return None
 
-    # Transpose để tính similarity giữa restaurants
-    # Cosine similarity giữa columns (restaurants)
-    item_similarity = cosine_similarity(user_item_matrix.T.values)
+    n_items = user_item_matrix.shape[1]
+
+    # Chuẩn hóa L2 từng cột (restaurant) -> tích vô hướng là cosine
+    norms = column_norms(user_item_matrix)
+    inv_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    normalized = (user_item_matrix @ diags(inv_norms.astype(np.float32))).tocsc()
+    normalized_t = normalized.T.tocsr()
+
+    if block_size is None:
+        block_size = max(1, CF_BLOCK_ELEMENTS // max(n_items, 1))
+
+    rows, cols, values = [], [], []
+    for start in range(0, n_items, block_size):
+        stop = min(start + block_size, n_items)
+
+        # (items × block) sparse, cột c là similarity của item start + c
+        block = (normalized_t @ normalized[:, start:stop]).tocoo()
+        item = block.col.astype(np.int32) + start
+        neighbor = block.row.astype(np.int32)
+        sims = block.data.astype(np.float32)
+
+        keep = (neighbor != item) & (sims > min_similarity)
+        item, neighbor, sims = _keep_top_k(item[keep], neighbor[keep], sims[keep], k)
+
+        rows.append(item)
+        cols.append(neighbor)
+        values.append(sims)
+
+    return csr_matrix(
+        (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n_items, n_items),
+        dtype=np.float32
+    )
+
+
+def column_norms(user_item_matrix):
+    """
+    Chuẩn L2 của từng cột (restaurant) của ma trận user-item
+    """
+    return np.sqrt(np.asarray(user_item_matrix.multiply(user_item_matrix).sum(axis=0)).ravel())
+
+
+def _keep_top_k(rows, cols, values, k):
+    """
+    Giữ k phần tử có value lớn nhất của mỗi dòng (k=None -> giữ tất cả)
+
+    Returns:
+        (rows, cols, values) sort theo (dòng, -value)
+    """
+    if k is None:
+        return rows, cols, values
+
+    # Sort theo (dòng, -value), giữ k phần tử đầu mỗi dòng
+    order = np.lexsort((-values, rows))
+    rows, cols, values = rows[order], cols[order], values[order]
+    first = np.searchsorted(rows, rows, side='left')
+    keep = np.arange(len(rows)) - first < k
+    return rows[keep], cols[keep], values[keep]
 
-    return pd.DataFrame(
-        item_similarity,
-        index=user_item_matrix.columns,
-        columns=user_item_matrix.columns
+
+def _similarity_rows(user_item_matrix, item_norms, items, min_similarity):
+    """
+    Similarity cosine của các cột items với mọi item (|items| × n_items),
+    bỏ chính nó và các giá trị <= min_similarity (thành 0)
+    """
+    # Chỉ các user đã rate một trong các cột items đóng góp vào tích vô hướng
+    columns = user_item_matrix[:, items].tocsr()
+    users = np.flatnonzero(np.diff(columns.indptr))
+    dots = np.asarray((columns[users].T @ user_item_matrix[users]).todense(), dtype=np.float64)
+    scale = item_norms[items][:, np.newaxis] * item_norms[np.newaxis, :]
+
+    sims = np.divide(dots, scale, out=np.zeros_like(dots), where=scale > 0).astype(np.float32)
+    sims[np.arange(len(items)), items] = 0
+    sims[sims <= min_similarity] = 0
+    return sims
+
+
+def update_item_similarity(item_similarity, user_item_matrix, item_norms, changed_items,
+                           k=DEFAULT_CF_NEIGHBORS, min_similarity=DEFAULT_CF_MIN_SIMILARITY):
+    """
+    Cập nhật similarity top-k sau khi rating của các cột changed_items đổi
+    (vd: một user vừa like / review), không tính lại toàn bộ
+
+    Chỉ tích vô hướng và chuẩn của các cột đã đổi bị ảnh hưởng:
+    - tính lại chuẩn các cột đó (sửa item_norms tại chỗ) và similarity của
+      chúng với mọi item (một tích sparse cột đổi × ma trận)
+    - thay dòng của chúng và các ô (j, changed) ở dòng các item khác
+    - dòng j đang đầy k láng giềng mà ô (j, changed) bị giảm được tính lại cả
+      dòng, vì một láng giềng đã bị cắt trước đó có thể quay lại top-k
+
+    Args:
+        item_similarity: csr_matrix top-k hiện tại (output calculate_item_similarity)
+        user_item_matrix: csr_matrix users × restaurants đã cập nhật
+        item_norms: Chuẩn L2 các cột (column_norms), sửa tại chỗ
+        changed_items: Chỉ số các cột có rating thay đổi
+
+    Returns:
+        csr_matrix top-k mới
+    """
+    changed_items = np.unique(np.asarray(changed_items, dtype=np.int32))
+    if len(changed_items) == 0:
+        return item_similarity
+
+    n_items = user_item_matrix.shape[1]
+    item_norms[changed_items] = column_norms(user_item_matrix[:, changed_items])
+    sims = _similarity_rows(user_item_matrix, item_norms, changed_items, min_similarity)
+
+    current = item_similarity.tocoo()
+    is_changed = np.zeros(n_items, dtype=bool)
+    is_changed[changed_items] = True
+    position = np.full(n_items, -1)
+    position[changed_items] = np.arange(len(changed_items))
+
+    # Dòng cần tính lại toàn bộ: đầy k láng giềng và ô (j, changed) bị giảm
+    row_counts = np.diff(item_similarity.indptr)
+    touched = ~is_changed[current.row] & is_changed[current.col]
+    decreased = touched.copy()
+    decreased[touched] = sims[position[current.col[touched]], current.row[touched]] < current.data[touched] - 1e-7
+    if k is not None:
+        decreased &= row_counts[current.row] >= k
+    refresh = np.unique(current.row[decreased]).astype(np.int32)
+
+    rebuilt = np.concatenate([changed_items, refresh])
+    is_rebuilt = is_changed.copy()
+    is_rebuilt[refresh] = True
+
+    # Dòng của item đổi + dòng tính lại (đầy đủ)
+    rows_sims = np.vstack([sims, _similarity_rows(user_item_matrix, item_norms, refresh, min_similarity)])
+    row_pos, neighbor = np.nonzero(rows_sims)
+    new_rows, new_cols, new_values = rebuilt[row_pos], neighbor.astype(np.int32), rows_sims[row_pos, neighbor]
+
+    # Ô (j, changed) ở dòng các item không tính lại; dòng đã đầy k láng giềng
+    # chỉ nhận ô không nhỏ hơn láng giềng nhỏ nhất hiện có (ô cũ (j, changed)
+    # luôn thỏa: giá trị tăng, hoặc giảm ở dòng chưa đầy)
+    row_floor = np.full(n_items, -np.inf, dtype=np.float32)
+    if k is not None:
+        full_rows = np.flatnonzero(row_counts >= k)
+        if len(full_rows):
+            row_floor[full_rows] = np.minimum.reduceat(item_similarity.data, item_similarity.indptr[full_rows])
+
+    changed_pos, other = np.nonzero(sims)
+    keep_other = ~is_rebuilt[other] & (sims[changed_pos, other] >= row_floor[other])
+    col_rows, col_cols = other[keep_other], changed_items[changed_pos[keep_other]]
+    col_values = sims[changed_pos[keep_other], other[keep_other]]
+
+    # Chỉ cắt lại top-k ở các dòng có ô mới, các dòng khác giữ nguyên
+    is_touched = is_rebuilt.copy()
+    is_touched[col_rows] = True
+    keep = ~is_rebuilt[current.row] & ~is_changed[current.col]
+    untouched = keep & ~is_touched[current.row]
+    retouched = keep & is_touched[current.row]
+
+    rows, cols, values = _keep_top_k(
+        np.concatenate([current.row[retouched], new_rows, col_rows]).astype(np.int32),
+        np.concatenate([current.col[retouched], new_cols, col_cols]).astype(np.int32),
+        np.concatenate([current.data[retouched], new_values, col_values]).astype(np.float32),
+        k
     )
 
+    rows = np.concatenate([current.row[untouched], rows])
+    cols = np.concatenate([current.col[untouched], cols])
+    values = np.concatenate([current.data[untouched], values])
+    return csr_matrix((values, (rows, cols)), shape=(n_items, n_items), dtype=np.float32)
+
 
 # =======================
 # Recommendation Functions
 # =======================
-def get_cf_recommendations(user_id, user_item_matrix, item_similarity_df, n=10):
+def get_cf_recommendations(user_id, user_item_matrix, item_similarity, user_index, item_ids, n=10):
     """
     Gợi ý dựa trên Item-Based Collaborative Filtering
 
     Args:
         user_id: ID của user
-        user_item_matrix: Ma trận user-item
-        item_similarity_df: Ma trận similarity giữa items
+        user_item_matrix: Ma trận user-item (csr_matrix)
+        item_similarity: Ma trận similarity giữa items (sparse)
+        user_index: Dict user_id -> dòng của user_item_matrix
+        item_ids: Restaurant ID theo cột
         n: Số lượng gợi ý
 
     Returns:
         List of (restaurant_id, predicted_score)
     """
-    if user_item_matrix is None or item_similarity_df is None:
+    if user_item_matrix is None or item_similarity is None:
         return []
 
     # Kiểm tra user có trong matrix không
-    if user_id not in user_item_matrix.index:
+    if user_id not in user_index:
         # User mới -> gợi ý popular items
-        return get_popular_recommendations(user_item_matrix, n)
+        return get_popular_recommendations(user_item_matrix, item_ids, n)
+
+    # Vector rating của user (dense, 0 = chưa rate) và vector chỉ thị đã rate
+    row = user_index[user_id]
+    start, stop = user_item_matrix.indptr[row], user_item_matrix.indptr[row + 1]
+    rated_items = user_item_matrix.indices[start:stop]
+
+    if len(rated_items) == 0:
+        return []
+
+    user_ratings = np.zeros(len(item_ids), dtype=np.float32)
+    user_ratings[rated_items] = user_item_matrix.data[start:stop]
+    rated = np.zeros(len(item_ids), dtype=np.float32)
+    rated[rated_items] = 1.0
+
+    # Weighted average cho mọi item cùng lúc: dòng i của item_similarity là
+    # láng giềng của i -> tử số = S·r, mẫu số = tổng similarity với các item đã rate
+    weighted = item_similarity @ user_ratings
+    similarity_sums = item_similarity @ rated
 
-    # Lấy ratings của user
-    user_ratings = user_item_matrix.loc[user_id]
+    valid = similarity_sums > 0
+    valid[rated_items] = False
+    candidates = np.flatnonzero(valid)
+    predictions = weighted[candidates] / similarity_sums[candidates]
 
-    # Tìm restaurants user chưa rate (rating = 0)
-    unrated_items = user_ratings[user_ratings == 0].index.tolist()
+    return _top_items(candidates, predictions, item_ids, n)
 
-    if not unrated_items:
+
+def get_als_recommendations(user_id, user_item_matrix, als_model, user_index, item_ids, n=10):
+    """
+    Gợi ý bằng ALS: điểm mọi restaurant là một tích U[u] @ Vᵀ
+
+    Args:
+        user_id: ID của user
+        user_item_matrix: Ma trận user-item (csr_matrix), để bỏ các quán đã rate
+        als_model: ALSModel đã train
+        user_index: Dict user_id -> dòng của user_item_matrix / user_factors
+        item_ids: Restaurant ID theo cột
+        n: Số lượng gợi ý
+
+    Returns:
+        List of (restaurant_id, predicted_score)
+    """
+    if user_item_matrix is None or als_model is None:
         return []
 
-    # Predict ratings cho unrated items
-    predictions = []
+    if user_id not in user_index:
+        return get_popular_recommendations(user_item_matrix, item_ids, n)
 
-    for item_id in unrated_items:
-        if item_id not in item_similarity_df.index:
-            continue
+    row = user_index[user_id]
+    rated_items = user_item_matrix.indices[user_item_matrix.indptr[row]:user_item_matrix.indptr[row + 1]]
 
-        # Lấy similarity với các items đã rate
-        rated_items = user_ratings[user_ratings > 0].index
+    scores = als_model.scores(als_model.user_factors[row])
+    unrated = np.ones(len(item_ids), dtype=bool)
+    unrated[rated_items] = False
+    candidates = np.flatnonzero(unrated)
 
-        if len(rated_items) == 0:
-            continue
+    return _top_items(candidates, scores[candidates], item_ids, n)
 
-        # Lấy similarity scores
-        similarities = item_similarity_df.loc[item_id, rated_items]
 
-        # Weighted average
-        if similarities.sum() > 0:
-            predicted_rating = (similarities * user_ratings[rated_items]).sum() / similarities.sum()
-            predictions.append((item_id, predicted_rating))
+def _top_items(candidates, scores, item_ids, n):
+    """
+    Top n (restaurant_id, score) theo score giảm dần, argpartition rồi
+    chỉ sort n phần tử
+    """
+    if len(candidates) == 0:
+        return []
 
-    # Sort theo predicted rating
-    predictions.sort(key=lambda x: x[1], reverse=True)
+    if len(candidates) > n:
+        top = np.argpartition(-scores, n - 1)[:n]
+    else:
+        top = np.arange(len(candidates))
+    top = top[np.argsort(-scores[top], kind='stable')]
 
-    return predictions[:n]
+    return [(int(item_ids[candidates[i]]), float(scores[i])) for i in top]
 
 
-def get_popular_recommendations(user_item_matrix, n=10):
+def get_popular_recommendations(user_item_matrix, item_ids, n=10):
     """
     Gợi ý dựa trên popularity (cho cold start users)
     """
     if user_item_matrix is None:
         return []
 
-    # Tính average rating cho mỗi restaurant
-    avg_ratings = user_item_matrix.mean(axis=0)
+    # Tính average rating cho mỗi restaurant (ô trống tính là 0 như pivot_table)
+    avg_ratings = np.asarray(user_item_matrix.sum(axis=0)).ravel() / user_item_matrix.shape[0]
 
     # Sort và lấy top n
-    top_items = avg_ratings.nlargest(n)
+    top_items = np.argsort(-avg_ratings, kind='stable')[:n]
 
-    return [(item_id, score) for item_id, score in top_items.items()]
+    return [(int(item_ids[item]), float(avg_ratings[item])) for item in top_items]
 
 
 # =======================
 # Main CF Model Class
 # =======================
 class CollaborativeFilteringModel:
-    def __init__(self):
+    def __init__(self, n_neighbors=DEFAULT_CF_NEIGHBORS, min_similarity=DEFAULT_CF_MIN_SIMILARITY,
+                 backend=CF_BACKEND):
+        self.backend = backend
+        self.n_neighbors = n_neighbors
+        self.min_similarity = min_similarity
         self.ratings_df = None
         self.user_item_matrix = None
-        self.user_similarity_df = None
-        self.item_similarity_df = None
+        self.user_ids = None
+        self.item_ids = None
+        self.user_index = {}
+        self._columns = None
+        self.user_similarity = None
+        self.item_similarity = None
+        self.item_norms = None
+        self.als = None
         self.is_trained = False
+        # Model được st.cache_resource dùng chung giữa các session: cập nhật
+        # tại chỗ và đọc đều giữ lock (RLock vì update_ratings gọi fold_in_user)
+        self._lock = threading.RLock()
+        _LOADED_MODELS.add(self)
+
+    def _set_matrix(self, user_item_matrix, user_ids, item_ids):
+        self.user_item_matrix = user_item_matrix
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+        self.user_index = {user_id: row for row, user_id in enumerate(user_ids)}
+        self._columns = None
 
     def train(self):
         """
@@ -260,14 +561,23 @@ class CollaborativeFilteringModel:
         print(f"Restaurants: {self.ratings_df['restaurant_id'].nunique()}")
 
         print("Building user-item matrix...")
-        self.user_item_matrix, _, _, _ = build_user_item_matrix(self.ratings_df)
+        user_item_matrix, user_ids, item_ids = build_user_item_matrix(self.ratings_df)
 
-        if self.user_item_matrix is None:
+        if user_item_matrix is None:
             self.is_trained = False
             return False
 
-        print("Calculating item similarity...")
-        self.item_similarity_df = calculate_item_similarity(self.user_item_matrix)
+        self._set_matrix(user_item_matrix, user_ids, item_ids)
+
+        if self.backend in ('als', 'als-explicit'):
+            print("Training ALS...")
+            self.als = ALSModel.fit(self.user_item_matrix, implicit=self.backend == 'als')
+        else:
+            print("Calculating item similarity...")
+            self.item_similarity = calculate_item_similarity(
+                self.user_item_matrix, self.n_neighbors, self.min_similarity
+            )
+            self.item_norms = column_norms(self.user_item_matrix)
 
         print("CF Model trained successfully!")
         self.is_trained = True
@@ -280,26 +590,405 @@ class CollaborativeFilteringModel:
         if not self.is_trained:
             return []
 
-        return get_cf_recommendations(
-            user_id,
-            self.user_item_matrix,
-            self.item_similarity_df,
-            n
-        )
+        with self._lock:
+            if self.als is not None:
+                return get_als_recommendations(
+                    user_id, self.user_item_matrix, self.als, self.user_index, self.item_ids, n
+                )
+
+            return get_cf_recommendations(
+                user_id,
+                self.user_item_matrix,
+                self.item_similarity,
+                self.user_index,
+                self.item_ids,
+                n
+            )
+
+    def user_ratings(self, user_id):
+        """
+        Rating hiện tại của user trong model
+
+        Returns:
+            Dict restaurant_id -> rating (rỗng nếu user chưa có)
+        """
+        with self._lock:
+            row = self.user_index.get(user_id)
+            if row is None:
+                return {}
+
+            lo, hi = self.user_item_matrix.indptr[row], self.user_item_matrix.indptr[row + 1]
+            return {
+                int(self.item_ids[col]): float(rating)
+                for col, rating in zip(self.user_item_matrix.indices[lo:hi], self.user_item_matrix.data[lo:hi])
+            }
+
+    def update_ratings(self, user_id, ratings):
+        """
+        Áp dụng rating delta của một user (vd: vừa like / viết review) ngay
+        trên model đã train: cập nhật dòng của user, chuẩn các item và các ô
+        similarity liên quan (ALS: fold-in lại factor của user)
+
+        Args:
+            user_id: ID của user (user mới được thêm vào)
+            ratings: Dict restaurant_id -> rating mới (None = xóa rating)
+        """
+        with self._lock:
+            merged = self.user_ratings(user_id)
+            for res_id, rating in ratings.items():
+                if rating is None:
+                    merged.pop(int(res_id), None)
+                else:
+                    merged[int(res_id)] = rating
+
+            self.fold_in_user(user_id, merged)
+
+    def fold_in_user(self, user_id, ratings):
+        """
+        Đặt lại toàn bộ rating của một user (vd: 'current_user' theo
+        preference_ratings) mà không train lại
+
+        Args:
+            user_id: ID của user (user mới được thêm vào cuối)
+            ratings: Dict restaurant_id -> rating (restaurant chưa có trong
+                model được thêm thành cột mới, xem _add_items)
+        """
+        if not self.is_trained:
+            return
+
+        with self._lock:
+            ratings = {int(res_id): float(np.clip(rating, 1, 10)) for res_id, rating in ratings.items()}
+            columns = self._item_columns()
+            new_items = self._add_items(sorted(set(ratings) - set(columns)))
+            columns = self._item_columns()
+
+            pairs = sorted((columns[res_id], rating) for res_id, rating in ratings.items())
+            items = np.array([col for col, _ in pairs], dtype=np.int32)
+            values = np.array([rating for _, rating in pairs], dtype=np.float32)
+
+            old = self.user_ratings(user_id)
+            row = self._replace_user_row(user_id, items, values)
+
+            if self.als is not None:
+                factors = self.als.fold_in(items, values)
+                if row == len(self.als.user_factors):
+                    self.als.user_factors = np.vstack([self.als.user_factors, factors])
+                else:
+                    self.als.user_factors[row] = factors
+                if len(new_items):
+                    self.als.item_factors[new_items] = self.als.fold_in_items(
+                        self.user_item_matrix[:, new_items].T
+                    )
+                return
+
+            # Chỉ các item có rating thay đổi ảnh hưởng tới similarity
+            changed = [columns[res_id] for res_id in set(old) | set(ratings)
+                       if not np.isclose(old.get(res_id, 0.0), ratings.get(res_id, 0.0))]
+
+            if self.item_norms is None:
+                self.item_norms = column_norms(self.user_item_matrix)
+            self.item_similarity = update_item_similarity(
+                self.item_similarity, self.user_item_matrix, self.item_norms, changed,
+                self.n_neighbors, self.min_similarity
+            )
+
+    def _item_columns(self):
+        if self._columns is None:
+            self._columns = {int(item_id): col for col, item_id in enumerate(self.item_ids)}
+        return self._columns
+
+    def _add_items(self, res_ids):
+        """
+        Thêm cột cho các restaurant chưa có trong model (vd: quán vừa được
+        like lần đầu): cột rating rỗng, chuẩn 0, dòng similarity rỗng
+        (ALS: factor 0, được giải lại sau khi fold-in user). update_item_similarity
+        sau đó tính similarity của các cột này như mọi cột có rating đổi
+
+        Returns:
+            np.ndarray vị trí các cột mới
+        """
+        n_items, n_new = len(self.item_ids), len(res_ids)
+        if n_new == 0:
+            return np.array([], dtype=np.int32)
+
+        matrix = self.user_item_matrix
+        self.user_item_matrix = csr_matrix((matrix.data, matrix.indices, matrix.indptr),
+                                           shape=(matrix.shape[0], n_items + n_new))
+
+        if self.als is not None:
+            self.als.item_factors = np.vstack([
+                self.als.item_factors,
+                np.zeros((n_new, self.als.item_factors.shape[1]), dtype=np.float32)
+            ])
+        else:
+            similarity = self.item_similarity
+            indptr = np.append(similarity.indptr, np.full(n_new, similarity.indptr[-1]))
+            self.item_similarity = csr_matrix((similarity.data, similarity.indices, indptr),
+                                              shape=(n_items + n_new, n_items + n_new))
+            if self.item_norms is not None:
+                self.item_norms = np.append(self.item_norms, np.zeros(n_new, dtype=self.item_norms.dtype))
+
+        self.item_ids = np.append(self.item_ids, np.asarray(res_ids, dtype=np.int64))
+        self._columns = None
+        return np.arange(n_items, n_items + n_new, dtype=np.int32)
+
+    def _replace_user_row(self, user_id, items, values):
+        """
+        Thay dòng rating của user_id (thêm dòng mới nếu chưa có) trong CSR
+
+        Returns:
+            Vị trí dòng của user
+        """
+        matrix = self.user_item_matrix
+        row = self.user_index.get(user_id)
+        is_new = row is None
+
+        if is_new:
+            row = matrix.shape[0]
+            indptr = np.append(matrix.indptr, matrix.indptr[-1])
+            matrix = csr_matrix((matrix.data, matrix.indices, indptr), shape=(row + 1, matrix.shape[1]))
+
+        lo, hi = matrix.indptr[row], matrix.indptr[row + 1]
+        indptr = matrix.indptr.copy()
+        indptr[row + 1:] += len(items) - (hi - lo)
+
+        # Gán ma trận trước rồi mới đăng ký user: dòng trong user_index luôn hợp lệ
+        self.user_item_matrix = csr_matrix((
+            np.concatenate([matrix.data[:lo], values, matrix.data[hi:]]),
+            np.concatenate([matrix.indices[:lo], items, matrix.indices[hi:]]),
+            indptr
+        ), shape=matrix.shape)
+
+        if is_new:
+            self.user_ids = np.append(self.user_ids, np.array([user_id], dtype=object))
+            self.user_index[user_id] = row
+        return row
+
+    def training_params(self):
+        """
+        Các tham số ảnh hưởng tới kết quả train (ghi vào bundle, dùng để
+        kiểm tra bundle còn khớp cấu hình hiện tại)
+        """
+        params = {'backend': self.backend}
+        if self.backend in ('als', 'als-explicit'):
+            params['als'] = [DEFAULT_ALS_FACTORS, DEFAULT_ALS_REGULARIZATION,
+                             DEFAULT_ALS_ITERATIONS, DEFAULT_ALS_ALPHA]
+        else:
+            params['n_neighbors'] = self.n_neighbors
+            params['min_similarity'] = self.min_similarity
+        return params
+
+    def save(self, path, sources=CF_BUNDLE_SOURCES):
+        """
+        Ghi model đã train thành bundle nhị phân (thư mục .npy + meta.json):
+        - users.data / users.offsets: user ID (UTF-8 nối liền + offsets int64),
+          thứ tự = dòng của ma trận
+        - items.npy: restaurant ID theo thứ tự cột
+        - ratings.{data,indices,indptr}.npy: ma trận rating CSR
+        - neighbors: item_similarity.{data,indices,indptr}.npy + item_norms.npy,
+          ALS: user_factors.npy + item_factors.npy
+        - meta.json: version, tham số train, fingerprint các file nguồn
+
+        Ghi qua model_cache.write_bundle (thư mục tạm rồi rename).
+
+        Args:
+            path: Thư mục bundle
+            sources: Các file ratings mà model được train từ đó
+
+        Returns:
+            True nếu ghi thành công
+        """
+        if not self.is_trained:
+            return False
+
+        encoded = [str(user_id).encode("utf-8") for user_id in self.user_ids]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+
+        arrays = {
+            'users.data': np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            'users.offsets': offsets,
+            'items': np.asarray(self.item_ids, dtype=np.int64)
+        }
+        sparse = {'ratings': self.user_item_matrix}
+        if self.als is not None:
+            arrays['user_factors'] = self.als.user_factors
+            arrays['item_factors'] = self.als.item_factors
+        else:
+            sparse['item_similarity'] = self.item_similarity
+            arrays['item_norms'] = self.item_norms if self.item_norms is not None \
+                else column_norms(self.user_item_matrix)
+
+        for name, matrix in sparse.items():
+            matrix = matrix.tocsr()
+            arrays[f"{name}.data"] = matrix.data
+            arrays[f"{name}.indices"] = matrix.indices
+            arrays[f"{name}.indptr"] = matrix.indptr
+
+        meta = {
+            'version': CF_BUNDLE_VERSION,
+            'params': self.training_params(),
+            'stats': file_stats(sources),
+            'source': file_fingerprint(sources, self.training_params()),
+            'shape': list(self.user_item_matrix.shape),
+            'nnz': int(self.user_item_matrix.nnz),
+            'trained_at': time.strftime('%Y-%m-%dT%H:%M:%S')
+        }
+
+        try:
+            write_bundle(path, arrays, meta)
+        except OSError:
+            return False
+
+        return True
+
+    @classmethod
+    def load(cls, path):
+        """
+        Dựng lại model đã train từ bundle (xem save), không đọc JSON ratings
+
+        Args:
+            path: Thư mục bundle
+
+        Returns:
+            CollaborativeFilteringModel, hoặc None nếu chưa có / sai version / hỏng
+        """
+        meta = read_cf_bundle_meta(path)
+        if meta is None or meta.get('version') != CF_BUNDLE_VERSION:
+            return None
+
+        def _load(name):
+            return np.load(os.path.join(path, f"{name}.npy"))
+
+        def _load_csr(name, shape):
+            return csr_matrix((_load(f"{name}.data"), _load(f"{name}.indices"), _load(f"{name}.indptr")),
+                              shape=shape)
+
+        try:
+            params = meta['params']
+            n_users, n_items = meta['shape']
+
+            blob = _load('users.data').tobytes()
+            offsets = _load('users.offsets').tolist()
+            user_ids = np.array([blob[lo:hi].decode("utf-8") for lo, hi in zip(offsets[:-1], offsets[1:])],
+                                dtype=object)
+
+            model = cls(n_neighbors=params.get('n_neighbors', DEFAULT_CF_NEIGHBORS),
+                        min_similarity=params.get('min_similarity', DEFAULT_CF_MIN_SIMILARITY),
+                        backend=params['backend'])
+            model._set_matrix(_load_csr('ratings', (n_users, n_items)), user_ids, _load('items'))
+
+            if model.backend in ('als', 'als-explicit'):
+                model.als = ALSModel(_load('user_factors'), _load('item_factors'),
+                                     implicit=model.backend == 'als')
+            else:
+                model.item_similarity = _load_csr('item_similarity', (n_items, n_items))
+                model.item_norms = _load('item_norms')
+
+        except (OSError, ValueError, KeyError):
+            return None
+
+        model.is_trained = True
+        return model
+
+
+# Các model đang dùng trong process (các page Streamlit chạy chung process),
+# để page khác có thể đẩy rating mới vào mà không train lại
+_LOADED_MODELS = weakref.WeakSet()
 
 
 # =======================
 # Utility Functions
 # =======================
-def load_cf_model():
+def cf_bundle_path(reviews_path=REVIEWS_FILE):
+    return os.path.splitext(reviews_path)[0] + CF_BUNDLE_SUFFIX
+
+
+def read_cf_bundle_meta(path):
+    try:
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def cf_bundle_matches(path, params, sources=CF_BUNDLE_SOURCES):
+    """
+    Bundle còn hợp lệ: cùng CF_BUNDLE_VERSION, cùng tham số train và file
+    nguồn không đổi. So size + mtime trước (không đọc file), chỉ hash nội
+    dung khi stat khác (vd: file được copy / touch lại)
+    """
+    meta = read_cf_bundle_meta(path)
+    if meta is None or meta.get('version') != CF_BUNDLE_VERSION or meta.get('params') != params:
+        return False
+
+    stats = file_stats(sources)
+    if meta.get('stats') == stats:
+        return True
+
+    if meta.get('source') != file_fingerprint(sources, params):
+        return False
+
+    # Nội dung không đổi: ghi lại stat để lần sau khỏi phải hash
+    meta['stats'] = stats
+    tmp_meta = os.path.join(path, f"meta.json.tmp-{os.getpid()}")
+    try:
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_meta, os.path.join(path, "meta.json"))
+    except OSError:
+        pass
+    return True
+
+
+def load_cf_model(use_cache=True, backend=CF_BACKEND):
     """
-    Load và train CF model
+    Load CF model từ bundle đã train (cf_bundle_path) nếu file comments /
+    reviews không đổi (rồi fold-in preferences hiện tại vào current_user),
+    ngược lại train lại và ghi bundle mới: khi bundle còn hợp lệ thời gian
+    khởi động không phụ thuộc kích thước file reviews
+
+    Args:
+        use_cache: False để luôn train lại
+        backend: 'neighbors', 'als' hoặc 'als-explicit' (xem CF_BACKEND)
     """
-    model = CollaborativeFilteringModel()
+    model = CollaborativeFilteringModel(backend=backend)
+    path = cf_bundle_path()
+
+    if use_cache and cf_bundle_matches(path, model.training_params()):
+        loaded = CollaborativeFilteringModel.load(path)
+        if loaded is not None:
+            # Preferences hiện tại (có thể đã đổi sau khi ghi bundle); quán
+            # chưa có trong bundle được thêm thành cột mới (xem fold_in_user)
+            ratings = {int(res_id): float(np.clip(rating, 1, 10))
+                       for res_id, rating in load_preference_ratings().items()}
+            if ratings != loaded.user_ratings('current_user'):
+                loaded.fold_in_user('current_user', ratings)
+            return loaded
+
     model.train()
+
+    if use_cache:
+        model.save(path)
+
     return model
 
 
+def update_loaded_models(user_id, ratings, replace=False):
+    """
+    Áp dụng rating delta cho mọi CollaborativeFilteringModel đang dùng trong
+    process (xem CollaborativeFilteringModel.update_ratings)
+
+    Args:
+        replace: True để thay toàn bộ rating của user (fold_in_user)
+    """
+    for model in list(_LOADED_MODELS):
+        if replace:
+            model.fold_in_user(user_id, ratings)
+        else:
+            model.update_ratings(user_id, ratings)
+
+
 # Test
 if __name__ == "__main__":
     print("Testing Collaborative Filtering Model...")
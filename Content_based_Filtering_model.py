@@ -1,9 +1,21 @@
 # Content_based_Filtering_model.py
-import itertools
+import json
+import os
+import sys
+import warnings
+from abc import ABC, abstractmethod
+from multiprocessing import Pool
+
 import pandas as pd
 import numpy as np
+from scipy.sparse import csr_matrix, hstack, vstack
 from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import MinMaxScaler
+from sklearn.preprocessing import MinMaxScaler, normalize
+
+from catalog import compact_frame, read_catalog_frame
+from filter_index import FilterIndex
+from name_index import NameIndex, find_row
+from model_cache import file_fingerprint, load_artifacts, save_artifacts, share_numeric_columns, write_bundle
 
 
 # =======================
@@ -13,218 +25,1537 @@ def load_and_prepare_data(json_path="./restaurants_with_coords.json"):
     """
     Load data và chuẩn bị features cho content-based filtering
     """
-    data = pd.read_json(json_path)
-
     # Chọn features cần thiết
     features = [
         'id', 'name', 'address', 'district', 'city', 'category',
         'food_categories', 'main_opening_hour', 'main_closing_hour',
-        'style', 'appropriate', 'suitable_time',
+        'sub_opening_hour', 'sub_closing_hour', 'style', 'appropriate', 'suitable_time',
         'average_price_min', 'avarage_price_max', 'average_rating',
         'quality_rating', 'service_rating', 'price_rating',
         'location_rating', 'space_rating'
     ]
 
+    # Chỉ đọc các cột cần (từ bundle nhị phân nếu có, xem catalog.convert_catalog)
+    data = read_catalog_frame(json_path, columns=features)
+
     # Lọc chỉ lấy các cột tồn tại
     existing_features = [f for f in features if f in data.columns]
     X = data[existing_features].copy()
 
-    # Fill NA
+    # Fill NA (cột categorical / chuỗi từ bundle -> object trước khi fill '')
     for col in X.columns:
-        if X[col].dtype == 'object':
-            X[col] = X[col].fillna('')
+        if not pd.api.types.is_numeric_dtype(X[col]):
+            X[col] = X[col].astype(object).fillna('')
         else:
             X[col] = X[col].fillna(0)
 
-    return X
+    # district/category/city -> categorical, giá -> int32, điểm -> float32
+    return compact_frame(X)
 
 
 # =======================
 # Xây dựng feature vector
 # =======================
-def build_feature_matrix(X):
-    """
-    Tạo ma trận đặc trưng từ nhiều features:
-    - Food categories (one-hot encoding)
-    - Style (one-hot encoding)
-    - Appropriate (one-hot encoding)
-    - Suitable time (one-hot encoding)
-    - District (one-hot encoding)
-    - Price range (normalized)
-    """
-
-    # 1. Food Categories Matrix
-    all_food_cats = list(set(itertools.chain.from_iterable(X['food_categories'])))
-    food_matrix = np.zeros((len(X), len(all_food_cats)))
-
-    for i, row in X.iterrows():
-        for j, cat in enumerate(all_food_cats):
-            if cat in row['food_categories']:
-                food_matrix[i, j] = 1
-
-    # 2. Style Matrix
-    all_styles = list(set(itertools.chain.from_iterable(X['style'])))
-    style_matrix = np.zeros((len(X), len(all_styles)))
-
-    for i, row in X.iterrows():
-        for j, style in enumerate(all_styles):
-            if style in row['style']:
-                style_matrix[i, j] = 1
-
-    # 3. Appropriate Matrix
-    all_appropriate = list(set(itertools.chain.from_iterable(X['appropriate'])))
-    appropriate_matrix = np.zeros((len(X), len(all_appropriate)))
-
-    for i, row in X.iterrows():
-        for j, app in enumerate(all_appropriate):
-            if app in row['appropriate']:
-                appropriate_matrix[i, j] = 1
-
-    # 4. Suitable Time Matrix
-    if 'suitable_time' in X.columns:
-        all_times = list(set(itertools.chain.from_iterable(X['suitable_time'])))
-        time_matrix = np.zeros((len(X), len(all_times)))
-
-        for i, row in X.iterrows():
-            for j, time in enumerate(all_times):
-                if time in row['suitable_time']:
-                    time_matrix[i, j] = 1
-    else:
-        time_matrix = np.zeros((len(X), 1))
+# Trọng số từng khối đặc trưng (theo đúng thứ tự ghép ma trận)
+FEATURE_WEIGHTS = {
+    'food_categories': 3,  # Món ăn quan trọng nhất
+    'style': 2,  # Phong cách
+    'appropriate': 2,  # Phù hợp với
+    'suitable_time': 1.5,  # Thời gian
+    'district': 1.5,  # Khu vực
+    'price': 1,  # Giá
+    'rating': 1  # Đánh giá
+}
 
-    # 5. District One-Hot
-    districts = X['district'].unique()
-    district_matrix = np.zeros((len(X), len(districts)))
-    district_dict = {d: i for i, d in enumerate(districts)}
+LIST_FEATURES = ['food_categories', 'style', 'appropriate', 'suitable_time']
+PRICE_FEATURES = ['average_price_min', 'avarage_price_max']
+RATING_FEATURES = ['average_rating']
 
-    for i, row in X.iterrows():
-        if row['district'] in district_dict:
-            district_matrix[i, district_dict[row['district']]] = 1
 
-    # 6. Price Range (normalized)
-    scaler = MinMaxScaler()
-    price_matrix = scaler.fit_transform(
-        X[['average_price_min', 'avarage_price_max']].values
+def encode_multi_hot(values):
+    """
+    Mã hóa một cột dạng list thành ma trận multi-hot dạng CSR
+    (một lượt vectorized, không lặp rows × vocabulary)
+
+    Args:
+        values: Series/list, mỗi phần tử là list các nhãn
+
+    Returns:
+        (csr_matrix shape (n, len(vocab)), vocab dict {nhãn: cột})
+    """
+    column = pd.Series(list(values), dtype=object)
+    exploded = column.explode()
+
+    # Bỏ list rỗng (NaN sau explode) và giá trị '' do fillna
+    keep = exploded.notna().to_numpy() & (exploded != '').to_numpy()
+    rows = exploded.index.to_numpy()[keep]
+    codes, uniques = pd.factorize(exploded.to_numpy()[keep], sort=True)
+
+    matrix = csr_matrix(
+        (np.ones(len(rows)), (rows, codes)),
+        shape=(len(column), len(uniques))
+    )
+    # Nhãn lặp lại trong cùng một quán vẫn chỉ tính là 1
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+
+    vocab = {label: j for j, label in enumerate(uniques)}
+    return matrix, vocab
+
+
+def encode_one_hot(values):
+    """
+    Mã hóa một cột giá trị đơn (vd: district) thành ma trận one-hot dạng CSR
+
+    Returns:
+        (csr_matrix shape (n, len(vocab)), vocab dict {giá trị: cột})
+    """
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    rows = np.flatnonzero(codes >= 0)
+
+    matrix = csr_matrix(
+        (np.ones(len(rows)), (rows, codes[rows])),
+        shape=(len(codes), len(uniques))
     )
 
+    vocab = {value: j for j, value in enumerate(uniques)}
+    return matrix, vocab
+
+
+def build_feature_blocks(X):
+    """
+    Tạo từng khối đặc trưng (chưa nhân trọng số):
+    - Food categories, Style, Appropriate, Suitable time (multi-hot)
+    - District (one-hot)
+    - Price range, Rating (normalized)
+
+    Với khối price/rating, "vocabulary" là {tên cột: [min, max]} của
+    MinMaxScaler, dùng để mã hóa thêm quán mới mà không fit lại.
+
+    Returns:
+        (blocks dict {tên khối: csr_matrix}, vocabularies dict {tên khối: vocab})
+    """
+    blocks = {}
+    vocabularies = {}
+
+    # 1-4. Các cột dạng list
+    for col in LIST_FEATURES:
+        if col in X.columns:
+            blocks[col], vocabularies[col] = encode_multi_hot(X[col])
+        else:
+            blocks[col], vocabularies[col] = csr_matrix((len(X), 0)), {}
+
+    # 5. District One-Hot
+    blocks['district'], vocabularies['district'] = encode_one_hot(X['district'])
+
+    # 6. Price Range (normalized)
     # 7. Rating (normalized)
-    if 'average_rating' in X.columns:
-        rating_matrix = scaler.fit_transform(
-            X[['average_rating']].values
-        )
-    else:
-        rating_matrix = np.zeros((len(X), 1))
-
-    # Kết hợp tất cả features với trọng số
-    # Food categories quan trọng nhất (weight = 3)
-    # Style, Appropriate (weight = 2)
-    # District, Time (weight = 1.5)
-    # Price, Rating (weight = 1)
-
-    combined_matrix = np.hstack([
-        food_matrix * 3,  # Món ăn quan trọng nhất
-        style_matrix * 2,  # Phong cách
-        appropriate_matrix * 2,  # Phù hợp với
-        time_matrix * 1.5,  # Thời gian
-        district_matrix * 1.5,  # Khu vực
-        price_matrix * 1,  # Giá
-        rating_matrix * 1  # Đánh giá
-    ])
+    for block, cols in [('price', PRICE_FEATURES), ('rating', RATING_FEATURES)]:
+        cols = [col for col in cols if col in X.columns]
+        if not cols:
+            blocks[block], vocabularies[block] = csr_matrix((len(X), 0)), {}
+            continue
+
+        scaler = MinMaxScaler()
+        blocks[block] = csr_matrix(scaler.fit_transform(X[cols].values))
+        vocabularies[block] = {
+            col: [float(lo), float(hi)]
+            for col, lo, hi in zip(cols, scaler.data_min_, scaler.data_max_)
+        }
+
+    return blocks, vocabularies
+
+
+def build_feature_matrix(X, return_vocab=False, weights=None):
+    """
+    Tạo ma trận đặc trưng (scipy.sparse CSR) từ nhiều features,
+    mỗi khối nhân với trọng số trong FEATURE_WEIGHTS
+
+    Args:
+        X: DataFrame
+        return_vocab: True để trả thêm vocabulary của từng khối
+        weights: Dict trọng số thay cho FEATURE_WEIGHTS (thiếu khối nào
+            thì dùng giá trị mặc định của khối đó)
+
+    Returns:
+        csr_matrix, hoặc (csr_matrix, vocabularies) nếu return_vocab=True
+    """
+    blocks, vocabularies = build_feature_blocks(X)
+    weights = {**FEATURE_WEIGHTS, **(weights or {})}
+
+    combined_matrix = hstack([
+        blocks[name] * weights[name] for name in FEATURE_WEIGHTS
+    ], format='csr')
+
+    if return_vocab:
+        return combined_matrix, vocabularies
 
     return combined_matrix
 
 
+def _block_offsets(vocabularies):
+    """
+    Cột bắt đầu của từng khối trong ma trận đặc trưng (theo FEATURE_WEIGHTS)
+    """
+    offsets = {}
+    start = 0
+    for name in FEATURE_WEIGHTS:
+        offsets[name] = start
+        start += len(vocabularies.get(name, {}))
+    return offsets, start
+
+
+def _record_labels(value):
+    """
+    Danh sách nhãn của một ô dạng list (giống encode_multi_hot)
+    """
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [label for label in value if label is not None and label != '']
+    if isinstance(value, str) and value != '':
+        return [value]
+    return []
+
+
+def grow_vocabularies(record, vocabularies):
+    """
+    Thêm các nhãn mới của một quán vào cuối vocabulary khối tương ứng
+    (vocabularies được cập nhật tại chỗ)
+
+    Returns:
+        List vị trí cột mới, theo thứ tự chèn (mỗi vị trí tính trên layout
+        sau các lần chèn trước đó)
+    """
+    new_columns = []
+
+    for block in LIST_FEATURES + ['district']:
+        if block not in vocabularies:
+            continue
+
+        labels = [record.get(block, '')] if block == 'district' else _record_labels(record.get(block))
+        vocab = vocabularies[block]
+
+        for label in labels:
+            if label not in vocab:
+                offsets, _ = _block_offsets(vocabularies)
+                new_columns.append(offsets[block] + len(vocab))
+                vocab[label] = len(vocab)
+
+    return new_columns
+
+
+def encode_restaurant(record, vocabularies):
+    """
+    Mã hóa một quán (dict) thành vector đặc trưng đã nhân trọng số,
+    cùng layout với build_feature_matrix. Nhãn chưa có trong vocabulary
+    bị bỏ qua (gọi grow_vocabularies trước nếu muốn thêm)
+
+    Returns:
+        np.ndarray 1-D float32
+    """
+    offsets, n_features = _block_offsets(vocabularies)
+    vector = np.zeros(n_features, dtype=np.float32)
+
+    for block in LIST_FEATURES + ['district']:
+        vocab = vocabularies.get(block, {})
+        labels = [record.get(block, '')] if block == 'district' else _record_labels(record.get(block))
+
+        for label in labels:
+            if label in vocab:
+                vector[offsets[block] + vocab[label]] = FEATURE_WEIGHTS[block]
+
+    # Price / Rating: dùng min/max đã fit (giống MinMaxScaler.transform)
+    for block in ['price', 'rating']:
+        for j, (col, (lo, hi)) in enumerate(vocabularies.get(block, {}).items()):
+            value = record.get(col) or 0
+            vector[offsets[block] + j] = (value - lo) / ((hi - lo) or 1) * FEATURE_WEIGHTS[block]
+
+    return vector
+
+
+# =======================
+# Block-wise weights (tuning)
+# =======================
+class BlockSimilarity:
+    """
+    Giữ riêng từng khối đặc trưng (chưa nhân trọng số) và Gram của từng khối
+    giữa các dòng query và toàn bộ catalog. Với bộ trọng số w bất kỳ:
+
+        cos(i, j) = Σ_b w_b² G_b[i, j] / sqrt(Σ_b w_b² |x_i,b|² · Σ_b w_b² |x_j,b|²)
+
+    nên đổi trọng số chỉ là tổ hợp tuyến tính các Gram, không mã hóa lại
+    và không nhân lại ma trận đặc trưng.
+    """
+
+    def __init__(self, blocks, rows=None):
+        n = next(iter(blocks.values())).shape[0]
+        self.rows = np.arange(n) if rows is None else np.asarray(rows)
+        self.grams = {}
+        self.sq_norms = {}
+
+        for name, block in blocks.items():
+            block = csr_matrix(block, dtype=np.float32)
+            self.grams[name] = np.asarray(block @ block[self.rows].toarray().T).T
+            self.sq_norms[name] = np.asarray(block.multiply(block).sum(axis=1)).ravel()
+
+    def similarity(self, weights=None):
+        """
+        Ma trận cosine similarity (len(rows) × N) với bộ trọng số weights
+
+        Args:
+            weights: Dict trọng số từng khối (thiếu khối nào thì dùng FEATURE_WEIGHTS)
+        """
+        weights = {**FEATURE_WEIGHTS, **(weights or {})}
+
+        dot = np.zeros_like(next(iter(self.grams.values())))
+        sq_norms = np.zeros_like(next(iter(self.sq_norms.values())))
+        for name, gram in self.grams.items():
+            w2 = np.float32(weights[name] ** 2)
+            dot += w2 * gram
+            sq_norms += w2 * self.sq_norms[name]
+
+        norms = np.sqrt(sq_norms)
+        norms[norms == 0] = 1
+        return dot / norms[self.rows][:, np.newaxis] / norms[np.newaxis, :]
+
+    def to_similarity_index(self, ids, weights=None):
+        """
+        DenseSimilarity với bộ trọng số mới (chỉ khi rows là toàn bộ catalog)
+        """
+        return DenseSimilarity(self.similarity(weights), ids)
+
+
+def build_block_similarity(X, rows=None):
+    """
+    Mã hóa X một lần và tính Gram từng khối cho việc dò trọng số offline
+
+    Args:
+        X: DataFrame
+        rows: Vị trí dòng dùng làm query (mặc định toàn bộ, tốn len(rows)·N
+            float32 cho mỗi khối — nên lấy mẫu khi catalog lớn)
+
+    Returns:
+        BlockSimilarity
+    """
+    blocks, _ = build_feature_blocks(X)
+    return BlockSimilarity(blocks, rows)
+
+
+# =======================
+# Similarity backends
+# =======================
+DEFAULT_TOP_K = 50
+
+# Số phần tử tối đa của một block similarity khi build (~64 MB float32)
+BLOCK_ELEMENTS = 16_000_000
+
+
+# Các cảnh báo đã in (mỗi loại chỉ một lần mỗi process, không lặp theo từng query)
+_WARNED = set()
+
+
+def _warn_once(key, message):
+    if key not in _WARNED:
+        _WARNED.add(key)
+        warnings.warn(message, stacklevel=3)
+
+
+def _top_n(scores, n, exclude=None):
+    """
+    Chọn n vị trí có điểm cao nhất bằng argpartition (O(N), không sort toàn bộ)
+
+    Args:
+        scores: Vector điểm (N)
+        n: Số phần tử cần lấy
+        exclude: Vị trí cần loại bỏ (vd: chính quán gốc)
+
+    Returns:
+        (rows, scores) đã sort giảm dần
+    """
+    if exclude is not None:
+        scores = np.array(scores, copy=True)
+        scores[exclude] = -np.inf
+        n = min(n, len(scores) - 1)
+    else:
+        n = min(n, len(scores))
+
+    if n <= 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=scores.dtype)
+
+    top = np.argpartition(-scores, n - 1)[:n]
+    top = top[np.argsort(-scores[top], kind='stable')]
+    return top, scores[top]
+
+
+def _top_k_per_row(sims, k):
+    """
+    Lấy top-k cột có điểm cao nhất cho mỗi dòng của block similarity
+    """
+    top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(sims, top, axis=1)
+
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def normalize_features(feature_matrix):
+    """
+    Chuẩn hóa L2 ma trận đặc trưng (CSR float32) để cosine = tích vô hướng
+    """
+    return normalize(csr_matrix(feature_matrix, dtype=np.float32))
+
+
+def build_id_lookup(ids):
+    """
+    Tạo index id → vị trí dòng:
+    - array int32 tra trực tiếp theo id (id nguyên không âm, khá liên tục),
+      có thể lưu/memory-map cùng các artifact khác
+    - dict cho các trường hợp còn lại
+    """
+    ids = np.asarray(ids)
+
+    if ids.dtype.kind in 'iu' and len(ids) > 0 and ids.min() >= 0 and ids.max() < 2 * len(ids) + 1024:
+        lookup = np.full(ids.max() + 1, -1, dtype=np.int32)
+        lookup[ids] = np.arange(len(ids), dtype=np.int32)
+        return lookup
+
+    return {restaurant_id: row for row, restaurant_id in enumerate(ids.tolist())}
+
+
+def _insert_empty_column(matrix, col):
+    """
+    Chèn một cột toàn 0 vào vị trí col của ma trận CSR (dịch các cột phía sau)
+    """
+    indices = np.array(matrix.indices)
+    indices[indices >= col] += 1
+    return csr_matrix((np.array(matrix.data), indices, np.array(matrix.indptr)),
+                      shape=(matrix.shape[0], matrix.shape[1] + 1))
+
+
+class SimilarityIndex(ABC):
+    """
+    Lớp cơ sở cho các similarity backend:
+    - ids / id_to_row: index id → vị trí dòng, tra cứu O(1) thay vì quét X['id']
+    - features: ma trận đặc trưng đã chuẩn hóa L2 (CSR float32)
+    - vocabularies: vocabulary của từng khối đặc trưng
+    - filters: FilterIndex (bitset theo district, món, style, giá) cùng thứ tự dòng
+    - names: NameIndex (tên không dấu -> vị trí dòng, prefix trie)
+    """
+
+    def __init__(self, ids, features=None, vocabularies=None, id_to_row=None, filters=None, names=None):
+        self.ids = np.asarray(ids)
+        self.id_to_row = build_id_lookup(self.ids) if id_to_row is None else id_to_row
+        self.features = features
+        self.vocabularies = vocabularies
+        self.filters = filters
+        self.names = names
+
+    @property
+    def shape(self):
+        n = len(self.ids)
+        return (n, n)
+
+    def row_of(self, restaurant_id):
+        """
+        Vị trí dòng của restaurant_id, None nếu không có
+        """
+        if isinstance(self.id_to_row, dict):
+            return self.id_to_row.get(restaurant_id)
+
+        if not isinstance(restaurant_id, (int, np.integer)) or not 0 <= restaurant_id < len(self.id_to_row):
+            return None
+
+        row = self.id_to_row[restaurant_id]
+        return int(row) if row >= 0 else None
+
+    @abstractmethod
+    def top_neighbors(self, row, n=10):
+        """
+        Lấy n quán tương tự nhất của dòng row (không gồm chính nó)
+
+        Returns:
+            (rows, scores) đã sort giảm dần
+        """
+
+    def filter_mask(self, filters):
+        """
+        Chuyển filter thành mask boolean theo vị trí dòng
+
+        Args:
+            filters: None, dict tham số của FilterIndex.mask
+                (vd: {'district': [...], 'price_range': (lo, hi)}), mask boolean
+                hoặc mảng vị trí dòng (vd: PriceIndex.rows_overlapping)
+
+        Returns:
+            np.ndarray bool hoặc None (không lọc)
+        """
+        if filters is None:
+            return None
+        if isinstance(filters, dict):
+            return self.filters.mask(**filters)
+
+        filters = np.asarray(filters)
+        if filters.dtype != bool:
+            mask = np.zeros(len(self.ids), dtype=bool)
+            mask[filters.astype(np.int64)] = True
+            return mask
+        return filters
+
+    def top_neighbors_filtered(self, row, n=10, mask=None):
+        """
+        Lấy n quán tương tự nhất của dòng row trong số các dòng thỏa mask:
+        chỉ tính similarity trên các dòng còn lại sau khi lọc, nên filter
+        càng chặt query càng nhanh
+
+        Returns:
+            (rows, scores) đã sort giảm dần
+        """
+        if mask is None:
+            return self.top_neighbors(row, n)
+
+        rows = np.flatnonzero(mask)
+        rows = rows[rows != row]
+        scores = self.features[rows] @ self.features[row].toarray().ravel()
+        top, top_scores = _top_n(scores, n)
+        return rows[top], top_scores
+
+    def upsert(self, record):
+        """
+        Thêm mới hoặc cập nhật một quán tại chỗ, không build lại model:
+        mã hóa theo vocabularies hiện có (thêm nhãn mới nếu cần), tính
+        similarity của quán với toàn bộ catalog bằng một mat-vec O(N·d),
+        rồi chỉ cập nhật những gì bị ảnh hưởng (xem _update_similarities)
+
+        Args:
+            record: Dict thông tin quán (bắt buộc có 'id')
+
+        Returns:
+            (row, is_new)
+        """
+        restaurant_id = record['id']
+        row = self.row_of(restaurant_id)
+        is_new = row is None
+
+        # 1. Thêm nhãn mới -> chèn cột rỗng vào ma trận đặc trưng
+        features = self.features
+        for col in grow_vocabularies(record, self.vocabularies):
+            features = self._insert_feature_column(features, col)
+
+        # 2. Mã hóa quán + chuẩn hóa L2
+        vector = normalize_features(encode_restaurant(record, self.vocabularies)[np.newaxis, :])
+
+        if is_new:
+            row = len(self.ids)
+            features = vstack([features, vector], format='csr')
+            self.ids = np.append(self.ids, restaurant_id)
+            self._set_row(restaurant_id, row)
+        else:
+            features = vstack([features[:row], vector, features[row + 1:]], format='csr')
+
+        self.features = features
+
+        # 3. Similarity của quán với toàn bộ catalog
+        sims = features @ vector.toarray().ravel()
+        self._update_similarities(row, sims, is_new)
+
+        return row, is_new
+
+    def _insert_feature_column(self, features, col):
+        """
+        Chèn cột rỗng (nhãn mới) vào ma trận đặc trưng tại vị trí col
+        """
+        return _insert_empty_column(features, col)
+
+    def _set_row(self, restaurant_id, row):
+        if not isinstance(self.id_to_row, dict):
+            if isinstance(restaurant_id, (int, np.integer)) and 0 <= restaurant_id < 2 * len(self.ids) + 1024:
+                lookup = np.full(max(len(self.id_to_row), restaurant_id + 1), -1, dtype=np.int32)
+                lookup[:len(self.id_to_row)] = self.id_to_row
+                lookup[restaurant_id] = row
+                self.id_to_row = lookup
+                return
+
+            # id quá thưa cho bảng tra trực tiếp -> chuyển sang dict
+            self.id_to_row = {restaurant_id: row for row, restaurant_id in enumerate(self.ids.tolist())}
+
+        self.id_to_row[restaurant_id] = row
+
+    def _update_similarities(self, row, sims, is_new):
+        """
+        Cập nhật cấu trúc similarity sau khi dòng row thay đổi
+        (sims: similarity mới của row với toàn bộ catalog)
+        """
+
+
+class DenseSimilarity(SimilarityIndex):
+    """
+    Ma trận cosine similarity N×N (chỉ dùng cho catalog nhỏ)
+    """
+
+    def __init__(self, matrix, ids=None, features=None):
+        super().__init__(np.arange(len(matrix)) if ids is None else ids, features)
+        self.matrix = matrix
+
+    def __getitem__(self, key):
+        return self.matrix[key]
+
+    def _update_similarities(self, row, sims, is_new):
+        if is_new:
+            matrix = np.zeros((row + 1, row + 1), dtype=self.matrix.dtype)
+            matrix[:row, :row] = self.matrix
+        else:
+            matrix = np.array(self.matrix)
+
+        matrix[row, :] = sims
+        matrix[:, row] = sims
+        self.matrix = matrix
+
+    def top_neighbors(self, row, n=10):
+        """
+        Lấy n quán tương tự nhất của dòng row (không gồm chính nó)
+
+        Returns:
+            (rows, scores) đã sort giảm dần
+        """
+        return _top_n(self.matrix[row], n, exclude=row)
+
+    def top_neighbors_filtered(self, row, n=10, mask=None):
+        if mask is None:
+            return self.top_neighbors(row, n)
+
+        rows = np.flatnonzero(mask)
+        rows = rows[rows != row]
+        top, top_scores = _top_n(self.matrix[row][rows], n)
+        return rows[top], top_scores
+
+
+class NeighborIndex(SimilarityIndex):
+    """
+    Chỉ lưu top-K quán tương tự nhất cho mỗi quán thay vì ma trận N×N:
+    - neighbor_rows: (N, K) int32, vị trí dòng của các quán tương tự
+    - neighbor_scores: (N, K) float32, cosine similarity (giảm dần)
+    """
+
+    def __init__(self, neighbor_rows, neighbor_scores, ids=None, features=None):
+        super().__init__(np.arange(len(neighbor_rows)) if ids is None else ids, features)
+        self.neighbor_rows = neighbor_rows
+        self.neighbor_scores = neighbor_scores
+
+    @property
+    def k(self):
+        return self.neighbor_rows.shape[1]
+
+    def top_neighbors(self, row, n=10):
+        """
+        Lấy n quán tương tự nhất của dòng row (không gồm chính nó)
+
+        Returns:
+            (rows, scores) đã sort giảm dần, tối đa K phần tử
+        """
+        return self.neighbor_rows[row, :n], self.neighbor_scores[row, :n]
+
+    def top_neighbors_filtered(self, row, n=10, mask=None):
+        """
+        Lọc danh sách top-K có sẵn trước (O(K)); chỉ khi còn lại ít hơn n
+        quán mới tính similarity trên các dòng thỏa mask
+        """
+        if mask is None:
+            return self.top_neighbors(row, n)
+
+        keep = mask[self.neighbor_rows[row]]
+        if keep.sum() >= n or keep.sum() == mask.sum() - mask[row]:
+            return self.neighbor_rows[row][keep][:n], self.neighbor_scores[row][keep][:n]
+
+        if self.features is None:
+            # Không có features (bảng materialize) -> chỉ lọc được trong top-K
+            _warn_once('table-filter', "Similar table has no features: filtered queries only search each "
+                                       "restaurant's stored top-K list and may return fewer than n results.")
+            return self.neighbor_rows[row][keep][:n], self.neighbor_scores[row][keep][:n]
+
+        return super().top_neighbors_filtered(row, n, mask)
+
+    def _update_similarities(self, row, sims, is_new):
+        """
+        Chỉ cập nhật các danh sách neighbor bị ảnh hưởng:
+        - danh sách của chính row
+        - quán đang chứa row mà điểm mới vẫn trong top-K: sửa điểm
+        - quán đang chứa row mà điểm mới rớt khỏi top-K: tính lại cả dòng
+        - quán chưa chứa row mà điểm mới vào top-K: chèn vào
+        """
+        neighbor_rows = np.array(self.neighbor_rows)
+        neighbor_scores = np.array(self.neighbor_scores)
+        k = self.k
+
+        if is_new:
+            neighbor_rows = np.vstack([neighbor_rows, np.zeros((1, k), dtype=np.int32)])
+            neighbor_scores = np.vstack([neighbor_scores, np.zeros((1, k), dtype=np.float32)])
+
+        if k == 0:
+            self.neighbor_rows, self.neighbor_scores = neighbor_rows, neighbor_scores
+            return
+
+        # Danh sách của chính row
+        top, top_scores = _top_n(sims, k, exclude=row)
+        neighbor_rows[row, :len(top)] = top
+        neighbor_scores[row, :len(top)] = top_scores
+
+        others = np.ones(len(sims), dtype=bool)
+        others[row] = False
+
+        contains = (neighbor_rows == row).any(axis=1) & others
+        kth_scores = neighbor_scores[:, -1]
+        stale = contains & (sims < kth_scores)
+        rescored = contains & ~stale
+        inserted = ~contains & others & (sims > kth_scores)
+
+        # Sửa điểm tại chỗ
+        hit = rescored[:, np.newaxis] & (neighbor_rows == row)
+        neighbor_scores[hit] = np.broadcast_to(sims[:, np.newaxis], hit.shape)[hit]
+
+        # Thay phần tử cuối bằng row
+        neighbor_rows[inserted, -1] = row
+        neighbor_scores[inserted, -1] = sims[inserted]
+
+        # Sort lại các dòng vừa sửa
+        changed = np.flatnonzero(rescored | inserted)
+        if len(changed):
+            order = np.argsort(-neighbor_scores[changed], axis=1, kind='stable')
+            neighbor_rows[changed] = np.take_along_axis(neighbor_rows[changed], order, axis=1)
+            neighbor_scores[changed] = np.take_along_axis(neighbor_scores[changed], order, axis=1)
+
+        # Tính lại toàn bộ các dòng bị rớt neighbor
+        stale_rows = np.flatnonzero(stale)
+        if len(stale_rows):
+            block = self.features[stale_rows].toarray()
+            block_sims = np.asarray(self.features @ block.T).T
+            block_sims[np.arange(len(stale_rows)), stale_rows] = -np.inf
+            neighbor_rows[stale_rows], neighbor_scores[stale_rows] = _top_k_per_row(block_sims, k)
+
+        self.neighbor_rows, self.neighbor_scores = neighbor_rows, neighbor_scores
+
+
+def _neighbor_block(features, start, stop, k):
+    """
+    Top-k quán tương tự của các dòng [start, stop)
+    """
+    # (N × d) @ (d × b) -> similarity của block với toàn bộ catalog
+    block = features[start:stop].toarray()
+    sims = np.asarray(features @ block.T).T
+
+    # Bỏ chính nó
+    sims[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+
+    return _top_k_per_row(sims, k)
+
+
+# Ma trận đặc trưng của worker process (gửi một lần qua initializer)
+_worker_features = None
+
+
+def _init_neighbor_worker(features):
+    global _worker_features
+    _worker_features = features
+
+
+def _neighbor_block_worker(task):
+    start, stop, k = task
+    return start, _neighbor_block(_worker_features, start, stop, k)
+
+
+def build_neighbor_index(feature_matrix, ids=None, k=DEFAULT_TOP_K, block_size=None, n_jobs=1):
+    """
+    Xây dựng NeighborIndex theo từng block dòng, không bao giờ tạo ma trận N×N
+
+    Args:
+        feature_matrix: Ma trận đặc trưng (sparse hoặc dense)
+        ids: Restaurant ID theo thứ tự dòng (mặc định 0..N-1)
+        k: Số quán tương tự giữ lại cho mỗi quán
+        block_size: Số dòng mỗi block (mặc định tự tính theo BLOCK_ELEMENTS)
+        n_jobs: Số process tính các block song song (None = số core)
+
+    Returns:
+        NeighborIndex
+    """
+    # float32 đủ chính xác cho ranking và nhanh gấp đôi khi nhân/partition
+    features = normalize_features(feature_matrix)
+    n = features.shape[0]
+    k = max(0, min(k, n - 1))
+
+    neighbor_rows = np.zeros((n, k), dtype=np.int32)
+    neighbor_scores = np.zeros((n, k), dtype=np.float32)
+
+    if k == 0:
+        return NeighborIndex(neighbor_rows, neighbor_scores, ids, features)
+
+    n_jobs = (os.cpu_count() or 1) if n_jobs is None else n_jobs
+
+    if block_size is None:
+        block_size = max(1, BLOCK_ELEMENTS // n)
+        # Đủ block để chia đều cho các process
+        block_size = min(block_size, -(-n // n_jobs))
+
+    tasks = [(start, min(start + block_size, n), k) for start in range(0, n, block_size)]
+
+    if n_jobs > 1 and len(tasks) > 1:
+        with Pool(n_jobs, initializer=_init_neighbor_worker, initargs=(features,)) as pool:
+            results = pool.imap_unordered(_neighbor_block_worker, tasks)
+            for start, (top, top_scores) in results:
+                neighbor_rows[start:start + len(top)] = top
+                neighbor_scores[start:start + len(top)] = top_scores
+    else:
+        for start, stop, _ in tasks:
+            neighbor_rows[start:stop], neighbor_scores[start:stop] = _neighbor_block(features, start, stop, k)
+
+    return NeighborIndex(neighbor_rows, neighbor_scores, ids, features)
+
+
+class LazySimilarity(SimilarityIndex):
+    """
+    Chỉ giữ ma trận đặc trưng đã chuẩn hóa L2 (xem normalize_features),
+    similarity của một quán được tính bằng một phép nhân sparse mat-vec khi query
+    """
+
+    def __init__(self, features, ids=None):
+        super().__init__(np.arange(features.shape[0]) if ids is None else ids, features)
+
+    def row_scores(self, row):
+        """
+        Cosine similarity giữa dòng row và toàn bộ catalog (vector N)
+        """
+        return self.features @ self.features[row].toarray().ravel()
+
+    def top_neighbors(self, row, n=10):
+        """
+        Lấy n quán tương tự nhất của dòng row (không gồm chính nó)
+
+        Returns:
+            (rows, scores) đã sort giảm dần
+        """
+        return _top_n(self.row_scores(row), n, exclude=row)
+
+
 # =======================
 # Build similarity model
 # =======================
-def build_similarity_model(X):
+# Chế độ similarity cho từng deployment:
+# - 'topk': build NeighborIndex lúc khởi động, query O(K)
+# - 'lazy': khởi động nhanh, mỗi query một phép sparse mat-vec
+# - 'ann': LSHIndex (ann_index.py), xấp xỉ, cho catalog nhiều thành phố
+# - 'dense': ma trận N×N (chỉ dùng cho catalog nhỏ)
+# - 'table': chỉ đọc bảng top-K materialize sẵn (build_similar_table), không
+#   giữ features -> taste profile / seeds gộp danh sách neighbor của các
+#   quán gốc; không dùng được upsert
+SIMILARITY_MODE = os.environ.get('SIMILARITY_MODE', 'topk')
+
+
+def build_similarity_model(X, mode='dense', k=DEFAULT_TOP_K):
+    """
+    Xây dựng similarity model
+
+    Args:
+        X: DataFrame
+        mode: 'dense' (DenseSimilarity), 'topk' (NeighborIndex),
+            'lazy' (LazySimilarity) hoặc 'ann' (LSHIndex)
+        k: Số quán tương tự giữ lại cho mỗi quán khi mode='topk'
+
+    Returns:
+        SimilarityIndex
+    """
+    feature_matrix, vocabularies = build_feature_matrix(X, return_vocab=True)
+    ids = X['id'].to_numpy()
+
+    if mode == 'topk':
+        model = build_neighbor_index(feature_matrix, ids, k=k)
+    elif mode == 'lazy':
+        model = LazySimilarity(normalize_features(feature_matrix), ids)
+    elif mode == 'ann':
+        from ann_index import build_lsh_index
+        model = build_lsh_index(feature_matrix, ids)
+    else:
+        cosine_sim = cosine_similarity(feature_matrix, feature_matrix)
+        model = DenseSimilarity(cosine_sim, ids, normalize_features(feature_matrix))
+
+    model.vocabularies = vocabularies
+    model.filters = FilterIndex.build(X)
+    model.names = NameIndex.build(X['name'])
+    return model
+
+
+def _model_to_artifacts(model):
     """
-    Xây dựng ma trận cosine similarity
+    Tách similarity model thành arrays + data để lưu artifact cache
     """
-    feature_matrix = build_feature_matrix(X)
-    cosine_sim = cosine_similarity(feature_matrix, feature_matrix)
-    return cosine_sim
+    arrays = {'ids': model.ids, 'features': model.features}
+
+    if not isinstance(model.id_to_row, dict):
+        arrays['id_to_row'] = model.id_to_row
+
+    data = {'vocabularies': model.vocabularies}
+
+    if isinstance(model, NeighborIndex):
+        arrays['neighbor_rows'] = model.neighbor_rows
+        arrays['neighbor_scores'] = model.neighbor_scores
+    elif isinstance(model, DenseSimilarity):
+        arrays['matrix'] = model.matrix
+    elif hasattr(model, 'bucket_rows'):
+        arrays['planes'] = model.planes
+        arrays['bucket_rows'] = model.bucket_rows
+        arrays['bucket_codes'] = model.bucket_codes
+        data['n_tables'] = model.n_tables
+        data['n_probes'] = model.n_probes
+
+    return arrays, data
+
+
+def _model_from_artifacts(mode, arrays, data):
+    """
+    Dựng lại similarity model từ artifact cache
+    """
+    if mode == 'topk':
+        model = NeighborIndex(arrays['neighbor_rows'], arrays['neighbor_scores'],
+                              arrays['ids'], arrays['features'])
+    elif mode == 'lazy':
+        model = LazySimilarity(arrays['features'], arrays['ids'])
+    elif mode == 'ann':
+        from ann_index import LSHIndex
+        model = LSHIndex(arrays['planes'], arrays['bucket_rows'], arrays['bucket_codes'],
+                         arrays['ids'], arrays['features'], data['n_tables'], data['n_probes'])
+    else:
+        model = DenseSimilarity(arrays['matrix'], arrays['ids'], arrays['features'])
+
+    if 'id_to_row' in arrays:
+        model.id_to_row = arrays['id_to_row']
+
+    model.vocabularies = data['vocabularies']
+    return model
+
+
+# =======================
+# Materialized similar table
+# =======================
+# Bảng nằm cạnh file JSON: restaurants_with_coords.json -> restaurants_with_coords.similar/
+SIMILAR_TABLE_SUFFIX = '.similar'
+SIMILAR_TABLE_VERSION = 1
+
+
+def similar_table_path(json_path):
+    return os.path.splitext(json_path)[0] + SIMILAR_TABLE_SUFFIX
+
+
+def _similar_table_key(json_path, k):
+    return file_fingerprint([json_path], {'k': k, 'weights': FEATURE_WEIGHTS})
+
+
+def build_similar_table(json_path="./restaurants_with_coords.json", out_path=None,
+                        k=DEFAULT_TOP_K, n_jobs=None):
+    """
+    Bước build offline: tính top-k quán tương tự cho mọi quán (song song
+    theo block dòng trên các core) và ghi thành các mảng độ rộng cố định:
+    - ids.npy: (N,) restaurant ID theo thứ tự dòng
+    - neighbor_ids.npy: (N, k) ID các quán tương tự
+    - neighbor_rows.npy: (N, k) int32, vị trí dòng tương ứng
+    - neighbor_scores.npy: (N, k) float32, giảm dần
+    - meta.json: k, fingerprint nguồn (file JSON + trọng số)
+
+    Args:
+        json_path: File JSON nguồn
+        out_path: Thư mục output (mặc định similar_table_path(json_path))
+        k: Số quán tương tự mỗi quán
+        n_jobs: Số process (None = số core)
+
+    Returns:
+        Đường dẫn bảng
+    """
+    out_path = out_path or similar_table_path(json_path)
+
+    X = load_and_prepare_data(json_path)
+    ids = X['id'].to_numpy()
+    index = build_neighbor_index(build_feature_matrix(X), ids, k=k, n_jobs=n_jobs)
+
+    arrays = {
+        'ids': ids,
+        'neighbor_ids': ids[index.neighbor_rows],
+        'neighbor_rows': index.neighbor_rows,
+        'neighbor_scores': index.neighbor_scores
+    }
+    return write_bundle(out_path, arrays, {
+        'version': SIMILAR_TABLE_VERSION,
+        'k': k,
+        'source': _similar_table_key(json_path, k)
+    })
+
+
+def load_similar_table(path, json_path=None, k=DEFAULT_TOP_K):
+    """
+    Memory-map bảng top-k đã build thành NeighborIndex chỉ đọc (không có
+    features): top_neighbors chỉ là một lát cắt O(1) của mảng trên đĩa
+
+    Args:
+        path: Thư mục bảng
+        json_path: Nếu có, kiểm tra bảng được build từ đúng nội dung file này
+        k: k mong muốn (dùng khi kiểm tra)
+
+    Returns:
+        NeighborIndex, hoặc None nếu chưa có / hết hạn
+    """
+    try:
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if meta.get('version') != SIMILAR_TABLE_VERSION:
+        return None
+    if json_path is not None and meta.get('source') != _similar_table_key(json_path, k):
+        return None
+
+    def _load(name):
+        return np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+
+    return NeighborIndex(_load('neighbor_rows'), _load('neighbor_scores'), _load('ids'))
+
+
+def load_content_model(json_path="./restaurants_with_coords.json", mode=SIMILARITY_MODE,
+                       k=DEFAULT_TOP_K, use_cache=True, mmap=True):
+    """
+    Load data + similarity model, dùng artifact cache trên đĩa
+    (key = hash nội dung file JSON + tham số build) để khởi động nhanh
+
+    Với mmap=True, ma trận đặc trưng, neighbor arrays và các cột số của X
+    được memory-map read-only từ cache: nhiều process/replica trên cùng máy
+    dùng chung page cache thay vì mỗi process giữ một bản copy.
+    Khi đó nên cache kết quả bằng st.cache_resource (st.cache_data sẽ copy).
+
+    Args:
+        json_path: File JSON nguồn
+        mode: 'dense', 'topk', 'lazy', 'ann' hoặc 'table'
+        k: Số quán tương tự giữ lại khi mode='topk' / 'table'
+        use_cache: False để luôn build lại
+        mmap: False để load toàn bộ artifact vào RAM
+
+    Returns:
+        (X, cosine_sim)
+    """
+    X = load_and_prepare_data(json_path)
+
+    if mode == 'table':
+        cosine_sim = load_similar_table(similar_table_path(json_path), json_path, k)
+        if cosine_sim is not None:
+            cosine_sim.filters = FilterIndex.build(X)
+            cosine_sim.names = NameIndex.build(X['name'])
+            return X, cosine_sim
+
+        # Bảng được build offline, không build trong process server
+        warnings.warn(
+            f"Similar table for {json_path} is missing or stale; run "
+            f"`python Content_based_Filtering_model.py build-similar {json_path}`. "
+            f"Falling back to mode='topk'."
+        )
+        mode = 'topk'
+
+    if not use_cache:
+        return X, build_similarity_model(X, mode=mode, k=k)
+
+    name = os.path.splitext(os.path.basename(json_path))[0]
+    kind = f"content-{name}-{mode}"
+    key = file_fingerprint([json_path], {'mode': mode, 'k': k, 'weights': FEATURE_WEIGHTS})
+    mmap_mode = 'r' if mmap else None
+
+    cached = load_artifacts(kind, key, mmap_mode=mmap_mode)
+    if cached is None:
+        cosine_sim = build_similarity_model(X, mode=mode, k=k)
+        save_artifacts(kind, key, *_model_to_artifacts(cosine_sim))
+
+        # Map lại từ đĩa để process đầu tiên cũng dùng chung page cache
+        cached = load_artifacts(kind, key, mmap_mode=mmap_mode)
+        if cached is None:
+            return X, cosine_sim
+
+    if mmap:
+        X = share_numeric_columns(X, f"prepared-{name}", file_fingerprint([json_path]))
+
+    cosine_sim = _model_from_artifacts(mode, *cached)
+    cosine_sim.filters = FilterIndex.build(X)
+    cosine_sim.names = NameIndex.build(X['name'])
+    return X, cosine_sim
+
+
+# =======================
+# Incremental updates
+# =======================
+def add_or_update_restaurant(record, X, cosine_sim):
+    """
+    Thêm mới hoặc cập nhật một quán mà không gọi lại load_and_prepare_data
+    và build_similarity_model trên toàn bộ catalog (O(N·d) thay vì O(N²·d))
+
+    Args:
+        record: Dict thông tin quán (bắt buộc có 'id')
+        X: DataFrame hiện tại
+        cosine_sim: SimilarityIndex (được cập nhật tại chỗ)
+
+    Returns:
+        X mới (cùng thứ tự dòng với cosine_sim)
+    """
+    row, is_new = cosine_sim.upsert(record)
+
+    # Fill NA giống load_and_prepare_data
+    values = {}
+    for col in X.columns:
+        value = record.get(col)
+        if value is None or (np.isscalar(value) and pd.isna(value)):
+            value = 0 if pd.api.types.is_numeric_dtype(X[col]) else ''
+        values[col] = value
+
+    new_row = pd.DataFrame([values], columns=X.columns)
+
+    if is_new:
+        X = pd.concat([X, new_row], ignore_index=True)
+    else:
+        X = pd.concat([X.iloc[:row], new_row, X.iloc[row + 1:]], ignore_index=True)
+
+    # concat với giá trị mới làm mất categorical -> mã hóa lại
+    X = compact_frame(X)
+
+    # Bitset / name index O(N), rẻ so với similarity
+    cosine_sim.filters = FilterIndex.build(X)
+    cosine_sim.names = NameIndex.build(X['name'])
+    return X
 
 
 # =======================
 # Recommendation functions
 # =======================
-def recommend_restaurants(restaurant_id, X, cosine_sim, n=10):
+def _recommend_rows(restaurant_id, X, cosine_sim, n=10, filters=None):
+    """
+    Tìm vị trí dòng và điểm similarity của n quán tương tự restaurant_id
+    (chỉ trong các quán thỏa filters, nếu có)
+
+    Returns:
+        (rows, scores), rỗng nếu không tìm thấy quán
+    """
+    if isinstance(cosine_sim, SimilarityIndex):
+        idx = cosine_sim.row_of(restaurant_id)
+    else:
+        # Ma trận numpy N×N truyền trực tiếp: không có index, phải quét cột id
+        matches = np.flatnonzero(X['id'].to_numpy() == restaurant_id)
+        idx = matches[0] if len(matches) else None
+
+    if idx is None:
+        return np.array([], dtype=np.int64), np.array([])
+
+    if isinstance(cosine_sim, SimilarityIndex):
+        return cosine_sim.top_neighbors_filtered(idx, n, cosine_sim.filter_mask(filters))
+
+    scores = cosine_sim[idx]
+    if filters is not None:
+        scores = np.where(np.asarray(filters, dtype=bool), scores, -np.inf)
+        n = min(n, int(np.isfinite(scores).sum()) - int(np.isfinite(scores[idx])))
+
+    return _top_n(scores, n, exclude=idx)
+
+
+def recommend_restaurants(restaurant_id, X, cosine_sim, n=10, filters=None):
     """
     Gợi ý n quán tương tự dựa trên restaurant_id
 
     Args:
         restaurant_id: ID của quán gốc
         X: DataFrame chứa data
-        cosine_sim: Ma trận cosine similarity
+        cosine_sim: SimilarityIndex (hoặc ma trận cosine similarity N×N)
         n: Số lượng gợi ý
+        filters: Dict filter (xem FilterIndex.mask) hoặc mask boolean,
+            áp dụng trước khi chọn top-n
 
     Returns:
         List of restaurant IDs (không bao gồm quán gốc)
     """
-    try:
-        # Lấy index của restaurant_id trong DataFrame
-        idx = X[X['id'] == restaurant_id].index[0]
+    rows, _ = _recommend_rows(restaurant_id, X, cosine_sim, n, filters)
 
-        # Lấy similarity scores
-        sim_scores = list(enumerate(cosine_sim[idx]))
+    # Trả về list IDs
+    return X['id'].to_numpy()[rows].tolist()
 
-        # Sort theo điểm similarity (cao → thấp)
-        sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
 
-        # Bỏ chính nó (index 0) và lấy top n
-        sim_scores = sim_scores[1:n + 1]
+def recommend_for_seeds(seed_ids, X, cosine_sim, n=10, exclude_ids=None, filters=None):
+    """
+    Gợi ý cho nhiều quán gốc cùng lúc (vd: toàn bộ liked_restaurants):
+    similarity của tất cả seed được tính bằng một phép nhân sparse
+    features @ seeds.T (chia block theo BLOCK_ELEMENTS), mỗi ứng viên lấy
+    điểm cao nhất trên các seed, bỏ trùng và bỏ chính các seed. Không có
+    features (bảng materialize): chỉ xét danh sách top-K của các seed
 
-        # Lấy indices
-        restaurant_indices = [i[0] for i in sim_scores]
+    Args:
+        seed_ids: List ID các quán gốc
+        X: DataFrame
+        cosine_sim: SimilarityIndex
+        n: Số lượng gợi ý
+        exclude_ids: List ID cần loại bỏ (vd: quán đã xem)
+        filters: Dict filter (xem FilterIndex.mask) hoặc mask boolean,
+            chỉ tính similarity trên các quán thỏa filter
 
-        # Trả về list IDs
-        return X.iloc[restaurant_indices]['id'].tolist()
+    Returns:
+        List of (restaurant_id, score, seed_id) đã sort theo score giảm dần
+    """
+    seed_rows = [cosine_sim.row_of(seed_id) for seed_id in seed_ids]
+    seed_rows = np.unique([row for row in seed_rows if row is not None])
+
+    if len(seed_rows) == 0:
+        return []
 
-    except IndexError:
+    mask = cosine_sim.filter_mask(filters)
+    if mask is None:
+        mask = np.ones(len(cosine_sim.ids), dtype=bool)
+    candidates = np.flatnonzero(mask)
+    if len(candidates) == 0:
         return []
 
+    if cosine_sim.features is None:
+        # Bảng materialize (không có features): gộp danh sách top-K của các
+        # seed, mỗi quán lấy điểm cao nhất
+        all_scores = np.full(len(cosine_sim.ids), -np.inf, dtype=np.float32)
+        all_seeds = np.zeros(len(cosine_sim.ids), dtype=np.int64)
+        for seed_row in seed_rows:
+            rows = np.asarray(cosine_sim.neighbor_rows[seed_row])
+            sims = np.asarray(cosine_sim.neighbor_scores[seed_row])
+
+            better = sims > all_scores[rows]
+            all_scores[rows[better]] = sims[better]
+            all_seeds[rows[better]] = seed_row
+
+        best_scores, best_seeds = all_scores[candidates], all_seeds[candidates]
+    else:
+        features = cosine_sim.features[candidates]
+        n_rows = features.shape[0]
+
+        best_scores = np.full(n_rows, -np.inf, dtype=np.float32)
+        best_seeds = np.zeros(n_rows, dtype=np.int64)
+
+        chunk = max(1, BLOCK_ELEMENTS // n_rows)
+        for start in range(0, len(seed_rows), chunk):
+            rows = seed_rows[start:start + chunk]
+
+            # (N × d) @ (d × s) -> similarity của mọi quán với từng seed
+            sims = np.asarray(features @ cosine_sim.features[rows].toarray().T)
+            best = sims.argmax(axis=1)
+            scores = sims[np.arange(n_rows), best]
+
+            better = scores > best_scores
+            best_scores[better] = scores[better]
+            best_seeds[better] = rows[best[better]]
+
+    # Bỏ chính các seed và các quán cần loại
+    excluded = np.zeros(len(cosine_sim.ids), dtype=bool)
+    excluded[seed_rows] = True
+    for restaurant_id in exclude_ids or []:
+        row = cosine_sim.row_of(restaurant_id)
+        if row is not None:
+            excluded[row] = True
+    best_scores[excluded[candidates]] = -np.inf
+
+    n = min(n, int(np.isfinite(best_scores).sum()))
+    top, top_scores = _top_n(best_scores, n)
+
+    ids = X['id'].to_numpy()
+    return [
+        (ids[row].item(), float(score), ids[seed].item())
+        for row, score, seed in zip(candidates[top], top_scores, best_seeds[top])
+    ]
+
+
+# =======================
+# Diversity re-ranking (MMR)
+# =======================
+# Số ứng viên đưa vào MMR (NeighborIndex chỉ có tối đa K ứng viên)
+DEFAULT_MMR_POOL = 200
+
+# 1.0 = chỉ xét độ liên quan, càng nhỏ càng ưu tiên đa dạng
+DEFAULT_MMR_LAMBDA = 0.7
+
 
-def get_recommendations(name, X, cosine_sim, top_n=5):
+def _pool_similarity(cosine_sim, rows):
+    """
+    Similarity giữa các ứng viên với nhau (P × P), chỉ tính trên pool
+    """
+    if getattr(cosine_sim, 'features', None) is not None:
+        block = cosine_sim.features[rows]
+        return np.asarray((block @ block.T).todense())
+
+    if isinstance(cosine_sim, DenseSimilarity):
+        return np.asarray(cosine_sim.matrix[np.ix_(rows, rows)])
+
+    if isinstance(cosine_sim, np.ndarray):
+        return cosine_sim[np.ix_(rows, rows)]
+
+    return None
+
+
+def mmr_rerank(rows, scores, cosine_sim, n=10, mmr_lambda=DEFAULT_MMR_LAMBDA):
+    """
+    Maximal marginal relevance trên một pool ứng viên nhỏ: lần lượt chọn
+    ứng viên có λ·relevance − (1−λ)·max(similarity với các quán đã chọn)
+    lớn nhất. Chi phí O(P²·d) cho sub-block + O(n·P), không phụ thuộc N.
+
+    Args:
+        rows: Vị trí dòng các ứng viên (P)
+        scores: Điểm relevance của ứng viên (cùng thang với similarity)
+        cosine_sim: SimilarityIndex (hoặc ma trận N×N) để tính sub-block
+        n: Số quán cần chọn
+        mmr_lambda: Trọng số relevance (1.0 = giữ nguyên thứ tự)
+
+    Returns:
+        np.ndarray vị trí (trong rows) của các quán được chọn, theo thứ tự chọn
+    """
+    rows = np.asarray(rows)
+    scores = np.asarray(scores, dtype=np.float64)
+    n = min(n, len(rows))
+
+    sims = _pool_similarity(cosine_sim, rows) if mmr_lambda < 1 else None
+    if sims is None:
+        # Không có features (vd: bảng materialize) -> giữ thứ tự relevance
+        if mmr_lambda < 1:
+            _warn_once('mmr-no-features', "Similarity model has no features: MMR diversity re-ranking is "
+                                          "skipped and results keep relevance order.")
+        return np.argsort(-scores, kind='stable')[:n]
+
+    selected = np.zeros(len(rows), dtype=bool)
+    max_sims = np.full(len(rows), -np.inf)
+    order = []
+
+    for _ in range(n):
+        redundancy = np.where(np.isfinite(max_sims), max_sims, 0)
+        gains = mmr_lambda * scores - (1 - mmr_lambda) * redundancy
+        gains[selected] = -np.inf
+
+        best = int(np.argmax(gains))
+        order.append(best)
+        selected[best] = True
+        max_sims = np.maximum(max_sims, sims[best])
+
+    return np.array(order, dtype=np.int64)
+
+
+# =======================
+# User taste profile
+# =======================
+# Hệ số giảm theo thứ tự thích: quán thích thứ i (tính từ quán mới nhất)
+# có trọng số decay**i. 1.0 = mọi quán như nhau
+DEFAULT_PROFILE_DECAY = 1.0
+
+
+class TasteProfile:
+    """
+    Vector sở thích của user = tổng có trọng số (decay theo độ mới) các
+    vector đặc trưng đã chuẩn hóa của quán đã thích. Cập nhật O(nnz) mỗi
+    lần thích thêm quán, query top-N là một phép mat-vec không phụ thuộc
+    độ dài lịch sử.
+    """
+
+    def __init__(self, decay=DEFAULT_PROFILE_DECAY):
+        self.decay = decay
+        self.vector = None
+        self.liked_ids = []
+        self.liked_rows = []
+
+    def add(self, restaurant_id, cosine_sim):
+        """
+        Thêm một quán vừa thích vào profile
+
+        Returns:
+            True nếu quán có trong model
+        """
+        row = cosine_sim.row_of(restaurant_id)
+        if row is None:
+            return False
+
+        # Không có features (bảng materialize): chỉ giữ danh sách quán đã thích,
+        # recommend_for_profile gộp danh sách neighbor của chúng
+        features = cosine_sim.features
+        if features is not None:
+            if self.vector is None:
+                self.vector = np.zeros(features.shape[1], dtype=np.float32)
+
+            self.vector *= self.decay
+            self.vector[features.indices[features.indptr[row]:features.indptr[row + 1]]] += \
+                features.data[features.indptr[row]:features.indptr[row + 1]]
+
+        self.liked_ids.append(restaurant_id)
+        self.liked_rows.append(row)
+        return True
+
+    def sync(self, liked_ids, cosine_sim):
+        """
+        Đồng bộ profile với liked_restaurants: nếu danh sách chỉ thêm quán
+        mới ở cuối thì cộng dồn, ngược lại (bỏ thích, số cột đặc trưng đổi
+        sau khi thêm quán vào catalog...) thì build lại
+        """
+        liked_ids = list(liked_ids)
+        n_known = len(self.liked_ids)
+
+        n_features = None if cosine_sim.features is None else cosine_sim.features.shape[1]
+        n_vector = None if self.vector is None else len(self.vector)
+        if (self.liked_rows and n_vector != n_features) or liked_ids[:n_known] != self.liked_ids:
+            self.vector = None
+            self.liked_ids = []
+            self.liked_rows = []
+            n_known = 0
+
+        for restaurant_id in liked_ids[n_known:]:
+            if not self.add(restaurant_id, cosine_sim):
+                # Giữ liked_ids khớp prefix để lần sync sau vẫn cộng dồn được
+                self.liked_ids.append(restaurant_id)
+
+        return self
+
+    @property
+    def is_empty(self):
+        return not self.liked_rows
+
+
+def build_taste_profile(liked_ids, cosine_sim, decay=DEFAULT_PROFILE_DECAY):
+    """
+    Tạo TasteProfile từ danh sách ID quán đã thích (theo thứ tự thích)
+    """
+    return TasteProfile(decay).sync(liked_ids, cosine_sim)
+
+
+def _neighbor_profile_scores(profile, cosine_sim):
+    """
+    Điểm theo profile khi không có features (NeighborIndex từ bảng
+    materialize): trung bình có trọng số (decay như vector profile)
+    similarity tới các quán đã thích, lấy từ danh sách top-K của từng quán
+
+    Returns:
+        (scores (N,), seeds (N,)): seeds là quán đã thích gần nhất,
+        scores = -inf với quán không nằm trong danh sách nào
+    """
+    liked_rows = np.asarray(profile.liked_rows)
+    weights = profile.decay ** np.arange(len(liked_rows) - 1, -1, -1, dtype=np.float64)
+
+    n_rows = len(cosine_sim.ids)
+    totals = np.zeros(n_rows, dtype=np.float64)
+    best = np.full(n_rows, -np.inf, dtype=np.float32)
+    seeds = np.zeros(n_rows, dtype=np.int64)
+
+    for liked_row, weight in zip(liked_rows, weights):
+        rows = np.asarray(cosine_sim.neighbor_rows[liked_row])
+        sims = np.asarray(cosine_sim.neighbor_scores[liked_row])
+        totals[rows] += weight * sims
+
+        closer = sims > best[rows]
+        best[rows[closer]] = sims[closer]
+        seeds[rows[closer]] = liked_row
+
+    scores = np.where(np.isfinite(best), totals / weights.sum(), -np.inf)
+    return scores, seeds
+
+
+def recommend_for_profile(profile, X, cosine_sim, n=10, exclude_ids=None, filters=None):
+    """
+    Gợi ý n quán gần vector sở thích nhất (một query duy nhất)
+
+    Args:
+        profile: TasteProfile
+        X: DataFrame
+        cosine_sim: SimilarityIndex
+        n: Số lượng gợi ý
+        exclude_ids: List ID cần loại bỏ (vd: quán đã xem)
+        filters: Dict filter (xem FilterIndex.mask) hoặc mask boolean,
+            chỉ chấm điểm các quán thỏa filter
+
+    Returns:
+        List of (restaurant_id, score, seed_id) đã sort theo score giảm dần,
+        seed_id là quán đã thích gần nhất với quán gợi ý (để giải thích)
+    """
+    if profile.is_empty:
+        return []
+
+    # Bỏ chính các quán đã thích và các quán cần loại
+    mask = cosine_sim.filter_mask(filters)
+    mask = np.ones(len(cosine_sim.ids), dtype=bool) if mask is None else mask.copy()
+    mask[profile.liked_rows] = False
+    for restaurant_id in exclude_ids or []:
+        row = cosine_sim.row_of(restaurant_id)
+        if row is not None:
+            mask[row] = False
+
+    features = cosine_sim.features
+    if features is None:
+        scores, seeds = _neighbor_profile_scores(profile, cosine_sim)
+        candidates = np.flatnonzero(mask & np.isfinite(scores))
+        top, top_scores = _top_n(scores[candidates], n)
+        top = candidates[top]
+
+        ids = X['id'].to_numpy()
+        return [
+            (ids[row].item(), float(score), ids[seeds[row]].item())
+            for row, score in zip(top, top_scores)
+        ]
+
+    candidates = np.flatnonzero(mask)
+    norm = np.linalg.norm(profile.vector)
+    scores = np.asarray(features[candidates] @ (profile.vector / norm)).ravel()
+
+    top, top_scores = _top_n(scores, n)
+    top = candidates[top]
+    n = len(top)
+
+    # Quán đã thích gần nhất với từng gợi ý: chỉ n × len(liked)
+    liked_rows = np.asarray(profile.liked_rows)
+    seed_sims = np.asarray((features[top] @ features[liked_rows].T).todense())
+    seeds = liked_rows[seed_sims.argmax(axis=1)] if n else liked_rows[:0]
+
+    ids = X['id'].to_numpy()
+    return [
+        (ids[row].item(), float(score), ids[seed].item())
+        for row, score, seed in zip(top, top_scores, seeds)
+    ]
+
+
+def get_recommendations(name, X, cosine_sim, top_n=5, filters=None, mmr_lambda=None):
     """
     Gợi ý quán dựa trên tên quán
 
     Args:
         name: Tên quán
         X: DataFrame
-        cosine_sim: Ma trận similarity
+        cosine_sim: SimilarityIndex (hoặc ma trận similarity N×N)
         top_n: Số lượng gợi ý
+        filters: Dict filter (xem FilterIndex.mask) hoặc mask boolean
+        mmr_lambda: Nếu có, đa dạng hóa top_n bằng MMR trên DEFAULT_MMR_POOL
+            ứng viên (vd: 0.7); None = chỉ theo similarity
 
     Returns:
         DataFrame chứa thông tin các quán gợi ý
     """
-    # Tìm quán theo tên (case-insensitive)
-    matches = X[X['name'].str.lower() == name.lower()]
+    # Tìm quán theo tên (không phân biệt hoa thường / dấu) qua NameIndex
+    names = getattr(cosine_sim, 'names', None)
+    if names is not None:
+        row = find_row(names, X['name'].to_numpy(), name)
+    else:
+        matches = np.flatnonzero((X['name'].str.lower() == name.lower()).to_numpy())
+        row = matches[0] if len(matches) else None
 
-    if len(matches) == 0:
+    if row is None:
         return pd.DataFrame()
 
-    idx = matches.index[0]
-    restaurant_id = X.loc[idx, 'id']
+    restaurant_id = X['id'].iloc[row]
 
-    # Dùng recommend_restaurants
-    recommended_ids = recommend_restaurants(restaurant_id, X, cosine_sim, top_n)
+    # Lấy vị trí dòng + similarity của các quán gợi ý
+    if mmr_lambda is None:
+        rows, scores = _recommend_rows(restaurant_id, X, cosine_sim, top_n, filters)
+    else:
+        rows, scores = _recommend_rows(restaurant_id, X, cosine_sim, max(DEFAULT_MMR_POOL, top_n), filters)
+        picked = mmr_rerank(rows, scores, cosine_sim, top_n, mmr_lambda)
+        rows, scores = rows[picked], scores[picked]
 
     # Lấy thông tin các quán
-    recommendations = X[X['id'].isin(recommended_ids)].copy()
+    recommendations = X.iloc[rows].copy()
 
-    # Thêm cột similarity score
-    for i, rec_id in enumerate(recommended_ids):
-        rec_idx = X[X['id'] == rec_id].index[0]
-        recommendations.loc[recommendations['id'] == rec_id, 'similarity'] = cosine_sim[idx][rec_idx]
-
-    # Sort theo similarity
-    recommendations = recommendations.sort_values('similarity', ascending=False)
+    # Thêm cột similarity score (giữ thứ tự: theo similarity, hoặc thứ tự chọn của MMR)
+    recommendations['similarity'] = scores
 
     return recommendations[['name', 'district', 'address', 'category', 'food_categories', 'similarity']]
 
 
-def get_recommendations_by_preferences(food_cats, districts, X, cosine_sim, top_n=10):
+def get_recommendations_by_preferences(food_cats, districts, X, cosine_sim, top_n=10, price_range=None):
     """
     Gợi ý quán dựa trên preferences của user
 
@@ -232,29 +1563,28 @@ def get_recommendations_by_preferences(food_cats, districts, X, cosine_sim, top_
         food_cats: List các loại món ăn
         districts: List các quận
         X: DataFrame
-        cosine_sim: Ma trận similarity
+        cosine_sim: SimilarityIndex (dùng bitset filters có sẵn)
         top_n: Số lượng gợi ý
+        price_range: (lo, hi) khoảng giá mong muốn
 
     Returns:
         List of restaurant IDs
     """
-    # Filter quán match preferences
-    filtered = X.copy()
+    filters = getattr(cosine_sim, 'filters', None) or FilterIndex.build(X)
 
-    if food_cats:
-        filtered = filtered[
-            filtered['food_categories'].apply(
-                lambda cats: any(cat in food_cats for cat in cats)
-            )
-        ]
-
-    if districts:
-        filtered = filtered[filtered['district'].isin(districts)]
+    # Filter quán match preferences (bitset, không dùng pandas apply)
+    mask = filters.mask(
+        food_categories=food_cats or None,
+        district=districts or None,
+        price_range=price_range
+    )
+    rows = np.arange(len(X)) if mask is None else np.flatnonzero(mask)
 
     # Sort theo rating và lấy top
-    filtered = filtered.sort_values('average_rating', ascending=False)
+    ratings = X['average_rating'].to_numpy()[rows]
+    top, _ = _top_n(ratings, top_n)
 
-    return filtered.head(top_n)['id'].tolist()
+    return X['id'].to_numpy()[rows[top]].tolist()
 
 
 # =======================
@@ -270,7 +1600,13 @@ def load_data(json_path="./restaurants_with_coords.json"):
 
 
 # Test
+# Build bảng top-K offline: python Content_based_Filtering_model.py build-similar [file.json ...]
 if __name__ == "__main__":
+    if sys.argv[1:2] == ['build-similar']:
+        for source in sys.argv[2:] or ["./restaurants_with_coords.json"]:
+            print(f"{source} -> {build_similar_table(source)}")
+        sys.exit(0)
+
     X, cosine_sim = load_data()
     print(f"Loaded {len(X)} restaurants")
     print(f"Similarity matrix shape: {cosine_sim.shape}")
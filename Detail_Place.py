@@ -6,6 +6,9 @@ import os
 import time as time_module
 import pydeck as pdk
 
+from catalog import load_catalog
+from Collaborative_Filtering_model import preference_ratings, update_loaded_models
+from name_index import NameIndex, find_row
 
 # Import comment analyzer
 try:
@@ -21,14 +24,19 @@ st.set_page_config(page_title="Chi tiết địa điểm", page_icon="📍", lay
 # ----------------------
 # LOAD DATA
 # ----------------------
-@st.cache_data
+@st.cache_resource
 def load_restaurants():
-    with open("./restaurants_with_coords.json", 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    return pd.DataFrame(data)
+    return load_catalog("./restaurants_with_coords.json")
+
+
+@st.cache_resource
+def load_name_index():
+    """Index tên không dấu (dựng một lần, dùng chung giữa các session)"""
+    return NameIndex.build(load_restaurants()['name'])
 
 
 df = load_restaurants()
+name_index = load_name_index()
 
 # ----------------------
 # COMMENT FUNCTIONS (JSON FILE)
@@ -116,9 +124,13 @@ def add_comment(restaurant_id, rating, comment_text, user_name):
 # ----------------------
 st.title("📍 Chi tiết địa điểm")
 
-# Tạo list tên quán để autocomplete
+# Tạo list tên quán để autocomplete (gõ không dấu, vd: "bun mam" -> "Bún Mắm ...")
 restaurant_names = df['name'].tolist()
 
+name_prefix = st.text_input("Tìm nhanh theo tên (có thể gõ không dấu)", placeholder="vd: bun mam")
+if name_prefix.strip():
+    restaurant_names = [restaurant_names[row] for row in name_index.prefix(name_prefix, limit=50)]
+
 # Search box
 search_query = st.selectbox(
     "🔍 Tìm kiếm quán ăn",
@@ -169,7 +181,7 @@ else:
     # ----------------------
     # CHI TIẾT QUÁN ĂN
     # ----------------------
-    restaurant = df[df['name'] == st.session_state.selected_restaurant].iloc[0]
+    restaurant = df.iloc[find_row(name_index, df['name'].to_numpy(), st.session_state.selected_restaurant)]
 
     # Back button
     if st.button("← Quay lại danh sách"):
@@ -343,6 +355,13 @@ else:
                     if success:
                         st.success("✅ Cảm ơn bạn đã đánh giá!")
 
+                        # Đẩy rating mới vào CF model đang chạy (trung bình các đánh giá
+                        # của user cho quán này, như khi train), không train lại
+                        user_ratings = [c.get('rating', 5) for c in get_restaurant_comments(restaurant['id'])
+                                        if c.get('user') == user_name.strip()]
+                        update_loaded_models(f"user_{user_name.strip()}",
+                                             {restaurant['id']: sum(user_ratings) / len(user_ratings)})
+
                         # Tự động phân tích comment
                         if ANALYZER_AVAILABLE:
                             try:
@@ -351,6 +370,8 @@ else:
 
                                 # Hiển thị thông báo nếu có thay đổi
                                 if updated_prefs:
+                                    update_loaded_models('current_user', preference_ratings(updated_prefs),
+                                                         replace=True)
                                     st.info("💡 Hệ thống đã học được sở thích của bạn từ đánh giá này!")
                             except Exception as e:
                                 # Silent fail - không làm gián đoạn UX
@@ -1,5 +1,5 @@
 import streamlit as st
-import pandas as pd
+import numpy as np
 import json
 import os
 import time
@@ -7,11 +7,16 @@ import re
 from datetime import datetime
 
 from Content_based_Filtering_model import (
-    load_and_prepare_data,
-    build_similarity_model,
-    recommend_restaurants
+    load_content_model,
+    recommend_for_profile,
+    mmr_rerank,
+    DEFAULT_MMR_LAMBDA,
+    DEFAULT_MMR_POOL,
+    TasteProfile,
+    SIMILARITY_MODE
 )
-from Collaborative_Filtering_model import load_cf_model
+from Collaborative_Filtering_model import load_cf_model, preference_ratings
+from catalog import load_compact_catalog
 from comment_analyzer import update_user_preferences, get_analysis_summary
 
 st.set_page_config(
@@ -24,11 +29,9 @@ st.set_page_config(
 # ----------------------
 # LOAD DATA & MODEL
 # ----------------------
-@st.cache_data
+@st.cache_resource
 def load_data():
-    X = load_and_prepare_data("./restaurants_with_coords.json")
-    cosine_sim = build_similarity_model(X)
-    return X, cosine_sim
+    return load_content_model("./restaurants_with_coords.json", mode=SIMILARITY_MODE)
 
 
 @st.cache_resource
@@ -38,17 +41,15 @@ def load_cf():
     return cf_model
 
 
-@st.cache_data
+@st.cache_resource
 def load_full_data():
-    """Load file JSON gốc để có đầy đủ thông tin"""
-    with open("./restaurants_with_coords.json", 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    return pd.DataFrame(data)
+    """Load catalog gọn (categorical, CSR list, int32/float32) để có đầy đủ thông tin"""
+    return load_compact_catalog("./restaurants_with_coords.json")
 
 
 X, cosine_sim = load_data()
 cf_model = load_cf()
-full_df = load_full_data()
+catalog = load_full_data()
 
 def district_sort_key(name):
     if name.startswith("Quận"):
@@ -68,6 +69,10 @@ USER_PREFS_FILE = "user_preferences.json"
 if 'user_preferences' not in st.session_state:
     st.session_state.user_preferences = None
 
+# Vector sở thích từ các quán đã thích (cache theo session)
+if 'taste_profile' not in st.session_state:
+    st.session_state.taste_profile = TasteProfile()
+
 
 def load_user_preferences():
     """Load preferences từ file hoặc session state"""
@@ -159,20 +164,32 @@ def add_to_history(restaurant_id, action="viewed"):
     elif action == "liked":
         if restaurant_id not in prefs["liked_restaurants"]:
             prefs["liked_restaurants"].append(restaurant_id)
+            # Cập nhật taste profile ngay, không build lại từ đầu
+            get_taste_profile(prefs, cosine_sim)
             # Đồng thời xóa khỏi viewed nếu có
             if restaurant_id in prefs["viewed_restaurants"]:
                 prefs["viewed_restaurants"].remove(restaurant_id)
+            # Cập nhật CF model tại chỗ (dòng current_user + similarity liên quan), không train lại
+            cf_model.fold_in_user('current_user', preference_ratings(prefs))
 
     return save_user_preferences(prefs)
 
 
+def get_taste_profile(user_prefs, cosine_sim):
+    """Taste profile của session, đồng bộ (cộng dồn) với liked_restaurants"""
+    return st.session_state.taste_profile.sync(user_prefs["liked_restaurants"], cosine_sim)
+
+
 # ----------------------
 # HYBRID RECOMMENDATION ENGINE
 # ----------------------
-def get_hybrid_recommendations(user_prefs, X, full_df, cosine_sim, cf_model, n=12, cf_weight=0.4, cb_weight=0.6):
+def get_hybrid_recommendations(user_prefs, X, catalog, cosine_sim, cf_model, n=12, cf_weight=0.4, cb_weight=0.6,
+                               mmr_lambda=DEFAULT_MMR_LAMBDA, open_at=None):
     """
     Hybrid Recommendation: 40% CF + 60% CB
     Ưu tiên quán ở các quận trong favorite_districts
+    Đa dạng hóa kết quả cuối bằng MMR (mmr_lambda=None để tắt)
+    open_at: datetime -> chỉ gợi ý quán đang mở cửa tại thời điểm đó
     """
     hybrid_scores = {}
 
@@ -202,85 +219,90 @@ def get_hybrid_recommendations(user_prefs, X, full_df, cosine_sim, cf_model, n=1
     # ==================
     cb_candidates = []
 
-    # Strategy A: Content-Based từ quán đã thích
+    # Bitset dựng sẵn trong model: lọc trước khi xếp hạng, không dùng pandas apply
+    filters = cosine_sim.filters
+    price_mask = filters.mask(price_range=user_prefs.get("price_range"), open_at=open_at)
+    if price_mask is None:
+        price_mask = np.ones(len(catalog), dtype=bool)
+
+    # Strategy A: Content-Based từ taste profile (một query, không phụ thuộc số quán đã thích)
     if user_prefs["liked_restaurants"]:
-        for rest_id in user_prefs["liked_restaurants"][-3:]:
-            if rest_id in X.index:
-                similar = recommend_restaurants(rest_id, X, cosine_sim, n=10)
-                for idx in similar:
-                    if idx not in user_prefs["viewed_restaurants"]:
-                        cb_candidates.append({
-                            'id': idx,
-                            'score': 0.95,
-                            'reason': f"Tương tự quán bạn đã thích"
-                        })
+        similar = recommend_for_profile(
+            get_taste_profile(user_prefs, cosine_sim), X, cosine_sim, n=30,
+            exclude_ids=user_prefs["viewed_restaurants"], filters=price_mask
+        )
+        for res_id, _, seed_id in similar:
+            seed_name = X.iloc[cosine_sim.row_of(seed_id)]['name']
+            cb_candidates.append({
+                'id': res_id,
+                'score': 0.95,
+                'reason': f"Tương tự quán bạn đã thích ({seed_name})"
+            })
 
     # Strategy B: Filter theo sở thích + ƯU TIÊN QUẬN
     if user_prefs["favorite_categories"]:
-        filtered_df = full_df[
-            full_df['food_categories'].apply(
-                lambda cats: any(cat in user_prefs["favorite_categories"] for cat in cats)
-            )
-        ]
+        category_mask = filters.mask(food_categories=user_prefs["favorite_categories"]) & price_mask
 
         # Ưu tiên quán ở favorite_districts trước
         if user_prefs["favorite_districts"]:
+            district_mask = filters.mask(district=user_prefs["favorite_districts"])
+
             # Quán ở quận yêu thích
-            priority_df = filtered_df[filtered_df['district'].isin(user_prefs["favorite_districts"])]
+            priority_df = catalog.take(np.flatnonzero(category_mask & district_mask)[:15])
 
-            for idx, row in priority_df.head(15).iterrows():
-                if idx not in user_prefs["viewed_restaurants"]:
+            for _, row in priority_df.iterrows():
+                if row['id'] not in user_prefs["viewed_restaurants"]:
                     matched_cats = [cat for cat in row['food_categories']
                                     if cat in user_prefs["favorite_categories"]]
                     cb_candidates.append({
-                        'id': idx,
+                        'id': int(row['id']),
                         'score': 0.90,  # Score cao hơn vì ở quận yêu thích
                         'reason': f"Phù hợp: {', '.join(matched_cats[:2])} tại {row['district']}"
                     })
 
             # Quán ở quận khác (điểm thấp hơn)
-            other_df = filtered_df[~filtered_df['district'].isin(user_prefs["favorite_districts"])]
-            for idx, row in other_df.head(10).iterrows():
-                if idx not in user_prefs["viewed_restaurants"]:
+            other_df = catalog.take(np.flatnonzero(category_mask & ~district_mask)[:10])
+            for _, row in other_df.iterrows():
+                if row['id'] not in user_prefs["viewed_restaurants"]:
                     matched_cats = [cat for cat in row['food_categories']
                                     if cat in user_prefs["favorite_categories"]]
                     cb_candidates.append({
-                        'id': idx,
+                        'id': int(row['id']),
                         'score': 0.75,  # Score thấp hơn
                         'reason': f"Phù hợp: {', '.join(matched_cats[:2])}"
                     })
         else:
             # Không có district preference → xử lý bình thường
-            for idx, row in filtered_df.head(15).iterrows():
-                if idx not in user_prefs["viewed_restaurants"]:
+            for _, row in catalog.take(np.flatnonzero(category_mask)[:15]).iterrows():
+                if row['id'] not in user_prefs["viewed_restaurants"]:
                     matched_cats = [cat for cat in row['food_categories']
                                     if cat in user_prefs["favorite_categories"]]
                     cb_candidates.append({
-                        'id': idx,
+                        'id': int(row['id']),
                         'score': 0.85,
                         'reason': f"Phù hợp với sở thích: {', '.join(matched_cats[:2])}"
                     })
 
     # Strategy C: Filter theo QUẬN trước (nếu có)
     if user_prefs["favorite_districts"]:
-        district_df = full_df[full_df['district'].isin(user_prefs["favorite_districts"])]
+        district_rows = np.flatnonzero(filters.mask(district=user_prefs["favorite_districts"]) & price_mask)
 
         # Lấy top rated ở quận yêu thích
-        top_in_district = district_df.nlargest(10, 'average_rating')
-        for idx, row in top_in_district.iterrows():
-            if idx not in user_prefs["viewed_restaurants"]:
+        top_in_district = catalog.nlargest(10, 'average_rating', district_rows)
+        for _, row in top_in_district.iterrows():
+            if row['id'] not in user_prefs["viewed_restaurants"]:
                 cb_candidates.append({
-                    'id': idx,
+                    'id': int(row['id']),
                     'score': 0.80,  # Score cao vì ở quận yêu thích
                     'reason': f"Đánh giá cao tại {row['district']} ({row['average_rating']}/10)"
                 })
 
     # Strategy D: Top rated (điểm thấp nhất)
-    top_rated = full_df.nlargest(15, 'average_rating')
-    for idx, row in top_rated.iterrows():
-        if idx not in user_prefs["viewed_restaurants"]:
+    top_rated = catalog.nlargest(15, 'average_rating', price_mask)
+    for _, row in top_rated.iterrows():
+        if row['id'] not in user_prefs["viewed_restaurants"]:
             cb_candidates.append({
-                'id': idx,
+                'id': int(row['id']),
                 'score': 0.70,
                 'reason': f"Đánh giá cao ({row['average_rating']}/10)"
             })
@@ -307,11 +329,22 @@ def get_hybrid_recommendations(user_prefs, X, full_df, cosine_sim, cf_model, n=1
     # ==================
     recommendations = []
 
+    # hybrid_scores theo restaurant id -> vị trí dòng (catalog và cosine_sim cùng thứ tự dòng)
+    rows_of = {res_id: cosine_sim.row_of(res_id) for res_id in hybrid_scores}
+
+    # Giải mã một lần tất cả quán ứng viên
+    # (quán đóng cửa bị loại ở đây luôn cả các gợi ý chỉ đến từ CF)
+    candidates_df = catalog.take([
+        row for res_id, row in rows_of.items()
+        if row is not None and (open_at is None or price_mask[row])
+    ])
+
     for res_id, scores in hybrid_scores.items():
-        if res_id not in full_df.index:
+        row = rows_of[res_id]
+        if row is None or row not in candidates_df.index:
             continue
 
-        restaurant = full_df.loc[res_id]
+        restaurant = candidates_df.loc[row]
 
         # Tính tổng điểm
         total_score = scores['cf_score'] + scores['cb_score']
@@ -340,6 +373,16 @@ def get_hybrid_recommendations(user_prefs, X, full_df, cosine_sim, cf_model, n=1
     # Sort theo hybrid score (bao gồm bonus)
     recommendations.sort(key=lambda x: x['score'], reverse=True)
 
+    # Đa dạng hóa: MMR trên pool ứng viên tốt nhất (tránh cùng chuỗi / cùng món)
+    if mmr_lambda is not None and recommendations:
+        pool = recommendations[:DEFAULT_MMR_POOL]
+        picked = mmr_rerank(
+            [rec['restaurant'].name for rec in pool],
+            [rec['score'] for rec in pool],
+            cosine_sim, n, mmr_lambda
+        )
+        return [pool[i] for i in picked]
+
     return recommendations[:n]
 
 
@@ -358,7 +401,7 @@ user_prefs = load_user_preferences()
 st.sidebar.header("⚙️ Tùy chọn của bạn")
 
 # Categories preference
-all_categories = list(set([cat for cats in X['food_categories'] for cat in cats]))
+all_categories = catalog.labels('food_categories')
 selected_categories = st.sidebar.multiselect(
     "🍜 Món ăn yêu thích",
     options=sorted(all_categories),
@@ -367,7 +410,7 @@ selected_categories = st.sidebar.multiselect(
 )
 
 # Districts preference
-all_districts = sorted(X['district'].unique().tolist(), key=district_sort_key)
+all_districts = sorted(catalog.labels('district'), key=district_sort_key)
 selected_districts = st.sidebar.multiselect(
     "📍 Khu vực quan tâm",
     options=all_districts,
@@ -385,6 +428,9 @@ price_range = st.sidebar.slider(
     format="%d đ"
 )
 
+# Chỉ gợi ý quán đang mở cửa (không lưu vào sở thích)
+open_now = st.sidebar.checkbox("🕒 Chỉ quán đang mở cửa", value=False)
+
 # Save preferences button
 if st.sidebar.button("💾 Lưu sở thích", type="primary", use_container_width=True):
     user_prefs["favorite_categories"] = selected_categories
@@ -451,7 +497,7 @@ if current_prefs.get("liked_restaurants"):
     with st.sidebar.expander("❤️ Quán đã thích"):
         for res_id in current_prefs["liked_restaurants"]:
             try:
-                matching = full_df[full_df['id'] == res_id]
+                matching = catalog.take(catalog.frame['id'].to_numpy() == res_id)
                 if not matching.empty:
                     restaurant_name = matching.iloc[0]['name']
                     st.write(f"• {restaurant_name}")
@@ -463,7 +509,8 @@ if current_prefs.get("liked_restaurants"):
 # ----------------------
 with st.spinner("🔍 Đang tìm kiếm gợi ý cho bạn..."):
     recommendations = get_hybrid_recommendations(
-        user_prefs, X, full_df, cosine_sim, cf_model, n=12
+        user_prefs, X, catalog, cosine_sim, cf_model, n=12,
+        open_at=datetime.now() if open_now else None
     )
 
 # ----------------------
@@ -549,8 +596,7 @@ else:
                                 if not is_liked:
                                     success = add_to_history(rest_id, "liked")
                                     if success:
-                                        st.cache_resource.clear()
-                                        st.cache_data.clear()
+                                        # Model đã được cập nhật trong add_to_history
                                         st.rerun()
                                     else:
                                         st.error("❌ Lỗi khi lưu. Vui lòng thử lại!")
@@ -0,0 +1,267 @@
+# als_model.py
+import sys
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# =======================
+# Cấu hình mặc định
+# =======================
+DEFAULT_ALS_FACTORS = 32
+DEFAULT_ALS_REGULARIZATION = 0.1
+DEFAULT_ALS_ITERATIONS = 10
+
+# Implicit: độ tin cậy c = 1 + alpha · rating
+DEFAULT_ALS_ALPHA = 2.0
+
+# Số bước conjugate gradient mỗi lần giải (warm start từ factor vòng trước)
+DEFAULT_ALS_CG_STEPS = 3
+
+# Số phần tử tối đa của khối tích ngoài (nnz × factors²) khi giải theo block
+ALS_BLOCK_ELEMENTS = 16_000_000
+
+
+# =======================
+# Một bước ALS
+# =======================
+def _normal_equations(matrix, fixed, regularization, implicit, alpha):
+    """
+    Vế phải b và hàm tính A·x của hệ phương trình chuẩn cho mọi dòng
+    (xem _solve_rows), không tạo ma trận A f × f của từng dòng
+    """
+    ratings = matrix.data.astype(np.float32)
+    row_of = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    factors = fixed[matrix.indices]
+
+    if implicit:
+        confidence = 1.0 + alpha * ratings
+        outer_weights = confidence - 1.0
+        rhs = csr_matrix((confidence, matrix.indices, matrix.indptr), shape=matrix.shape) @ fixed
+        gram = fixed.T @ fixed
+    else:
+        outer_weights = np.ones_like(ratings)
+        rhs = csr_matrix((ratings, matrix.indices, matrix.indptr), shape=matrix.shape) @ fixed
+        gram = None
+
+    def apply(x):
+        # Σ w_ui (y_i · x_u) y_i cho mọi dòng: một phép nhân sparse @ dense
+        dots = np.einsum('ij,ij->i', factors, x[row_of]) * outer_weights
+        result = csr_matrix((dots, matrix.indices, matrix.indptr), shape=matrix.shape) @ fixed
+        result += regularization * x
+        if gram is not None:
+            result += x @ gram
+        return result
+
+    return np.asarray(rhs, dtype=np.float32), apply
+
+
+def _conjugate_gradient_rows(matrix, fixed, current, regularization, implicit, alpha, steps):
+    """
+    Giải xấp xỉ hệ phương trình chuẩn của mọi dòng bằng vài bước conjugate
+    gradient, bắt đầu từ factor hiện tại. Mỗi bước chỉ tốn O(nnz · f)
+    (không tạo nnz tích ngoài f × f), mọi dòng được cập nhật cùng lúc.
+
+    Returns:
+        (n_rows × f) float32
+    """
+    rhs, apply = _normal_equations(matrix, fixed, regularization, implicit, alpha)
+
+    x = current.copy()
+    residual = rhs - apply(x)
+    direction = residual.copy()
+    residual_norm = np.einsum('ij,ij->i', residual, residual)
+
+    for _ in range(steps):
+        product = apply(direction)
+        curvature = np.einsum('ij,ij->i', direction, product)
+        step = np.divide(residual_norm, curvature, out=np.zeros_like(residual_norm), where=curvature > 0)
+
+        x += step[:, np.newaxis] * direction
+        residual -= step[:, np.newaxis] * product
+
+        new_norm = np.einsum('ij,ij->i', residual, residual)
+        beta = np.divide(new_norm, residual_norm, out=np.zeros_like(new_norm), where=residual_norm > 0)
+        direction = residual + beta[:, np.newaxis] * direction
+        residual_norm = new_norm
+
+    return x.astype(np.float32)
+
+
+def _solve_rows(matrix, fixed, regularization, implicit, alpha):
+    """
+    Giải least squares cho mọi dòng của matrix với factor phía còn lại cố định
+
+    Với dòng u có các cột Iu (rating r_ui):
+    - explicit: (Σ y_i y_iᵀ + λI) x_u = Σ r_ui y_i
+    - implicit: (YᵀY + Σ (c_ui - 1) y_i y_iᵀ + λI) x_u = Σ c_ui y_i
+
+    Tổng các tích ngoài y_i y_iᵀ theo từng dòng được tính bằng một phép nhân
+    sparse (dòng × nnz) @ (nnz × f²) mỗi block, rồi giải cả block bằng
+    np.linalg.solve (LAPACK) -> không có vòng lặp Python theo từng user.
+
+    Giải chính xác, dùng cho fold-in (ít dòng); train dùng
+    _conjugate_gradient_rows.
+
+    Args:
+        matrix: csr_matrix (dòng cần giải × cột cố định)
+        fixed: Factor của các cột, (n_cols × f) float32
+
+    Returns:
+        (n_rows × f) float32
+    """
+    n_rows = matrix.shape[0]
+    n_factors = fixed.shape[1]
+    eye = regularization * np.eye(n_factors, dtype=np.float32)
+    gram = fixed.T @ fixed if implicit else None
+
+    solution = np.zeros((n_rows, n_factors), dtype=np.float32)
+    block_nnz = max(1, ALS_BLOCK_ELEMENTS // (n_factors * n_factors))
+
+    start = 0
+    while start < n_rows:
+        # Lấy đủ dòng sao cho số nnz của block không vượt block_nnz
+        stop = int(np.searchsorted(matrix.indptr, matrix.indptr[start] + block_nnz, side='right')) - 1
+        stop = min(max(stop, start + 1), n_rows)
+
+        lo, hi = matrix.indptr[start], matrix.indptr[stop]
+        columns = matrix.indices[lo:hi]
+        ratings = matrix.data[lo:hi].astype(np.float32)
+        local_indptr = matrix.indptr[start:stop + 1] - lo
+
+        if implicit:
+            confidence = 1.0 + alpha * ratings
+            outer_weights, rhs_weights = confidence - 1.0, confidence
+        else:
+            outer_weights, rhs_weights = np.ones_like(ratings), ratings
+
+        factors = fixed[columns]
+        outer = (factors[:, :, np.newaxis] * factors[:, np.newaxis, :]).reshape(len(columns), -1)
+
+        weights = csr_matrix((outer_weights, np.arange(len(columns)), local_indptr),
+                             shape=(stop - start, len(columns)))
+        lhs = np.asarray(weights @ outer).reshape(-1, n_factors, n_factors) + eye
+        if implicit:
+            lhs += gram
+
+        rhs_matrix = csr_matrix((rhs_weights, np.arange(len(columns)), local_indptr),
+                                shape=(stop - start, len(columns)))
+        rhs = np.asarray(rhs_matrix @ factors)
+
+        solution[start:stop] = np.linalg.solve(lhs, rhs[:, :, np.newaxis])[:, :, 0]
+        start = stop
+
+    return solution
+
+
+# =======================
+# ALS model
+# =======================
+class ALSModel:
+    """
+    Matrix factorization R ≈ U·Vᵀ học bằng Alternating Least Squares
+    (mỗi nửa vòng là vài bước conjugate gradient vectorized, các phép nhân
+    ma trận đi qua BLAS nên tự dùng nhiều thread):
+    - user_factors: (n_users × f) float32
+    - item_factors: (n_items × f) float32
+
+    Điểm của user u cho mọi restaurant là một tích U[u] @ Vᵀ. User mới
+    (hoặc user vừa có thêm rating) được fold-in: giải một bước least squares
+    với V cố định, không cần train lại.
+    """
+
+    def __init__(self, user_factors, item_factors, implicit=True,
+                 regularization=DEFAULT_ALS_REGULARIZATION, alpha=DEFAULT_ALS_ALPHA):
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.implicit = implicit
+        self.regularization = regularization
+        self.alpha = alpha
+
+    @classmethod
+    def fit(cls, user_item_matrix, factors=DEFAULT_ALS_FACTORS, regularization=DEFAULT_ALS_REGULARIZATION,
+            iterations=DEFAULT_ALS_ITERATIONS, implicit=True, alpha=DEFAULT_ALS_ALPHA,
+            cg_steps=DEFAULT_ALS_CG_STEPS, seed=42):
+        """
+        Train ALS từ ma trận users × restaurants (output của build_user_item_matrix)
+
+        Args:
+            user_item_matrix: csr_matrix rating (0 = chưa rate)
+            factors: Số chiều latent
+            regularization: Hệ số λ
+            iterations: Số vòng (mỗi vòng giải U rồi V)
+            implicit: True = coi rating là độ tin cậy (Hu-Koren-Volinsky),
+                False = khớp trực tiếp giá trị rating
+            alpha: Hệ số độ tin cậy cho implicit
+            cg_steps: Số bước conjugate gradient mỗi nửa vòng
+            seed: Seed khởi tạo V
+
+        Returns:
+            ALSModel
+        """
+        matrix = user_item_matrix.tocsr().astype(np.float32)
+        matrix_t = matrix.T.tocsr()
+
+        rng = np.random.default_rng(seed)
+        item_factors = (rng.standard_normal((matrix.shape[1], factors)) * 0.01).astype(np.float32)
+        user_factors = np.zeros((matrix.shape[0], factors), dtype=np.float32)
+
+        for _ in range(iterations):
+            user_factors = _conjugate_gradient_rows(matrix, item_factors, user_factors,
+                                                    regularization, implicit, alpha, cg_steps)
+            item_factors = _conjugate_gradient_rows(matrix_t, user_factors, item_factors,
+                                                    regularization, implicit, alpha, cg_steps)
+
+        return cls(user_factors, item_factors, implicit, regularization, alpha)
+
+    def fold_in(self, items, ratings):
+        """
+        Factor của một user từ các rating của họ, với item factors cố định
+
+        Args:
+            items: Chỉ số cột các restaurant đã rate
+            ratings: Rating tương ứng
+
+        Returns:
+            np.ndarray (f,) float32
+        """
+        row = csr_matrix(
+            (np.asarray(ratings, dtype=np.float32), np.asarray(items, dtype=np.int32), [0, len(items)]),
+            shape=(1, self.item_factors.shape[0])
+        )
+        return _solve_rows(row, self.item_factors, self.regularization, self.implicit, self.alpha)[0]
+
+    def fold_in_items(self, item_user_matrix):
+        """
+        Factor của các item từ rating của chúng (vd: restaurant vừa được
+        thêm vào model), với user factors cố định
+
+        Args:
+            item_user_matrix: csr_matrix (các item × mọi user)
+
+        Returns:
+            (n_items × f) float32
+        """
+        return _solve_rows(item_user_matrix.tocsr(), self.user_factors, self.regularization,
+                           self.implicit, self.alpha)
+
+    def scores(self, user_vector):
+        """
+        Điểm của user cho mọi restaurant: user_vector @ Vᵀ
+        """
+        return self.item_factors @ user_vector
+
+
+# Benchmark: python als_model.py
+if __name__ == "__main__":
+    from Collaborative_Filtering_model import build_user_item_matrix, load_user_ratings
+
+    matrix, user_ids, item_ids = build_user_item_matrix(load_user_ratings())
+    if matrix is None:
+        sys.exit("No ratings data found!")
+
+    for implicit in (True, False):
+        start = time.perf_counter()
+        model = ALSModel.fit(matrix, implicit=implicit)
+        print(f"{'implicit' if implicit else 'explicit'} ALS: {matrix.shape[0]} users × {matrix.shape[1]} "
+              f"restaurants, {matrix.nnz} ratings in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,288 @@
+# ann_index.py
+import sys
+import time
+
+import numpy as np
+from scipy.sparse import hstack
+
+from Content_based_Filtering_model import (
+    BLOCK_ELEMENTS,
+    FEATURE_WEIGHTS,
+    SimilarityIndex,
+    _top_n,
+    build_feature_blocks,
+    build_feature_matrix,
+    load_and_prepare_data,
+    normalize_features
+)
+
+# =======================
+# Cấu hình mặc định
+# =======================
+DEFAULT_TABLES = 16
+
+# Số bit thăm thêm mỗi bảng khi query: tăng -> recall cao hơn, chậm hơn
+DEFAULT_PROBES = 2
+
+
+# =======================
+# Random-projection LSH
+# =======================
+class LSHIndex(SimilarityIndex):
+    """
+    Approximate nearest neighbor cho cosine similarity (SimHash nhiều bảng):
+    - planes: (T·b, d) float32, siêu phẳng ngẫu nhiên
+    - bucket_codes: (T, N) int32, hash code của từng quán, đã sort theo từng bảng
+    - bucket_rows: (T, N) int32, vị trí dòng tương ứng với bucket_codes
+
+    Query: lấy các quán cùng bucket với quán gốc ở mỗi bảng (thêm n_probes
+    bucket lân cận bằng cách lật các bit gần siêu phẳng nhất), rồi rerank
+    chính xác bằng features. n_probes là núm chỉnh recall/latency.
+    """
+
+    def __init__(self, planes, bucket_rows, bucket_codes, ids=None, features=None,
+                 n_tables=DEFAULT_TABLES, n_probes=DEFAULT_PROBES):
+        super().__init__(np.arange(bucket_rows.shape[1]) if ids is None else ids, features)
+        self.planes = planes
+        self.bucket_rows = bucket_rows
+        self.bucket_codes = bucket_codes
+        self.n_tables = n_tables
+        self.n_bits = planes.shape[0] // n_tables
+        self.n_probes = n_probes
+
+    def _hash(self, projections):
+        """
+        (M, T·b) projections -> (M, T) hash codes
+        """
+        bits = (projections > 0).reshape(len(projections), self.n_tables, self.n_bits)
+        weights = (1 << np.arange(self.n_bits)).astype(np.int32)
+        return (bits * weights).sum(axis=2).astype(np.int32)
+
+    def candidates(self, vector, n_probes=None):
+        """
+        Vị trí dòng các quán ứng viên cho vector query (đã chuẩn hóa L2)
+        """
+        n_probes = self.n_probes if n_probes is None else n_probes
+
+        projections = (self.planes @ vector)[np.newaxis, :]
+        codes = self._hash(projections)[0]
+
+        # Lật các bit có |projection| nhỏ nhất (dễ rơi sang bucket bên cạnh)
+        margins = np.abs(projections[0]).reshape(self.n_tables, self.n_bits)
+        flips = np.argsort(margins, axis=1)[:, :n_probes]
+        probe_codes = np.concatenate([codes[:, np.newaxis], codes[:, np.newaxis] ^ (1 << flips)], axis=1)
+
+        # Cùng dtype với bucket_codes, tránh searchsorted cast cả mảng mỗi lần
+        probe_codes = probe_codes.astype(self.bucket_codes.dtype)
+
+        found = []
+        for t in range(self.n_tables):
+            lo = np.searchsorted(self.bucket_codes[t], probe_codes[t], side='left')
+            hi = np.searchsorted(self.bucket_codes[t], probe_codes[t], side='right')
+            found.extend(self.bucket_rows[t, a:b] for a, b in zip(lo, hi) if b > a)
+
+        if not found:
+            return np.array([], dtype=np.int32)
+
+        return np.unique(np.concatenate(found))
+
+    def query_vector(self, vector, n=10, n_probes=None, exclude=None):
+        """
+        Tìm n quán gần vector nhất (xấp xỉ)
+
+        Returns:
+            (rows, scores) đã sort giảm dần
+        """
+        rows = self.candidates(vector, n_probes)
+        if exclude is not None:
+            rows = rows[rows != exclude]
+
+        # Quá ít ứng viên -> quét toàn bộ
+        if len(rows) < n:
+            scores = self.features @ vector
+            return _top_n(scores, n, exclude=exclude)
+
+        scores = self.features[rows] @ vector
+        top, top_scores = _top_n(scores, n)
+        return rows[top], top_scores
+
+    def top_neighbors(self, row, n=10, n_probes=None):
+        """
+        Lấy n quán tương tự nhất của dòng row (không gồm chính nó), xấp xỉ
+
+        Returns:
+            (rows, scores) đã sort giảm dần
+        """
+        vector = self.features[row].toarray().ravel()
+        return self.query_vector(vector, n, n_probes, exclude=row)
+
+    def _insert_feature_column(self, features, col):
+        """
+        Nhãn mới: chèn thêm một chiều ngẫu nhiên vào các siêu phẳng ở cùng
+        vị trí col. Các quán cũ có 0 ở cột này nên projection / hash code
+        của chúng không đổi, không cần hash lại
+        """
+        rng = np.random.default_rng(self.planes.shape[1])
+        column = rng.standard_normal(self.planes.shape[0]).astype(np.float32)
+        self.planes = np.insert(self.planes, col, column, axis=1)
+        return super()._insert_feature_column(features, col)
+
+    def _update_similarities(self, row, sims, is_new):
+        """
+        Đưa dòng row vào đúng bucket ở mọi bảng (xóa bucket cũ nếu sửa)
+        """
+        codes = self._hash(self.features[row].toarray() @ self.planes.T)[0]
+
+        bucket_rows = []
+        bucket_codes = []
+        for t in range(self.n_tables):
+            table_rows = self.bucket_rows[t]
+            table_codes = self.bucket_codes[t]
+
+            if not is_new:
+                keep = table_rows != row
+                table_rows, table_codes = table_rows[keep], table_codes[keep]
+
+            pos = np.searchsorted(table_codes, codes[t], side='right')
+            bucket_rows.append(np.insert(table_rows, pos, row))
+            bucket_codes.append(np.insert(table_codes, pos, codes[t]))
+
+        self.bucket_rows = np.vstack(bucket_rows).astype(np.int32)
+        self.bucket_codes = np.vstack(bucket_codes).astype(np.int32)
+
+
+def build_lsh_index(feature_matrix, ids=None, n_tables=DEFAULT_TABLES, n_bits=None,
+                    n_probes=DEFAULT_PROBES, seed=42):
+    """
+    Xây dựng LSHIndex từ output của build_feature_matrix
+
+    Args:
+        feature_matrix: Ma trận đặc trưng (sparse hoặc dense)
+        ids: Restaurant ID theo thứ tự dòng
+        n_tables: Số bảng hash (nhiều -> recall cao, tốn bộ nhớ T·N)
+        n_bits: Số bit mỗi bảng (mặc định ~log2(N), bucket trung bình vài quán)
+        n_probes: Số bucket lân cận thăm thêm mỗi bảng khi query
+        seed: Seed sinh siêu phẳng
+
+    Returns:
+        LSHIndex
+    """
+    features = normalize_features(feature_matrix)
+    n, d = features.shape
+
+    if n_bits is None:
+        n_bits = int(np.clip(np.log2(max(n, 2)), 8, 30))
+
+    rng = np.random.default_rng(seed)
+    planes = rng.standard_normal((n_tables * n_bits, d)).astype(np.float32)
+
+    index = LSHIndex(planes, np.zeros((n_tables, 0), dtype=np.int32), np.zeros((n_tables, 0), dtype=np.int32),
+                     ids, features, n_tables, n_probes)
+
+    # Hash theo block để không tạo ma trận projection N × T·b
+    codes = np.zeros((n, n_tables), dtype=np.int32)
+    block_size = max(1, BLOCK_ELEMENTS // (n_tables * n_bits))
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        codes[start:stop] = index._hash(np.asarray(features[start:stop] @ planes.T))
+
+    index.bucket_rows = np.argsort(codes.T, axis=1, kind='stable').astype(np.int32)
+    index.bucket_codes = np.take_along_axis(codes.T, index.bucket_rows, axis=1)
+    return index
+
+
+# =======================
+# Benchmark
+# =======================
+def synthesize_feature_matrix(X, n_rows, seed=0):
+    """
+    Sinh catalog giả lập cỡ lớn (vd: nhiều thành phố): mỗi khối đặc trưng
+    của một quán giả được lấy từ một quán thật ngẫu nhiên khác nhau
+    """
+    blocks, _ = build_feature_blocks(X)
+    rng = np.random.default_rng(seed)
+
+    return hstack([
+        blocks[name][rng.integers(0, len(X), n_rows)] * weight
+        for name, weight in FEATURE_WEIGHTS.items()
+    ], format='csr')
+
+
+def benchmark(index, n_queries=100, k=10, probes=(0, 1, 2, 4), seed=0):
+    """
+    So sánh LSHIndex với exact search: recall@k và latency trung bình
+
+    Recall tính theo điểm (quán trả về có điểm >= điểm thứ k của exact
+    được tính là đúng) để không bị ảnh hưởng bởi các quán bằng điểm.
+
+    Returns:
+        List dict {n_probes, recall, ann_ms, exact_ms, candidates}
+    """
+    features = index.features
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(features.shape[0], min(n_queries, features.shape[0]), replace=False)
+
+    results = []
+    for n_probes in probes:
+        hits = 0
+        n_candidates = 0
+        ann_time = 0.0
+        exact_time = 0.0
+
+        for row in queries:
+            vector = features[row].toarray().ravel()
+
+            start = time.perf_counter()
+            rows, _ = index.query_vector(vector, k, n_probes, exclude=row)
+            ann_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            exact_rows, exact_scores = _top_n(features @ vector, k, exclude=row)
+            exact_time += time.perf_counter() - start
+
+            scores = features[rows] @ vector
+            hits += int((scores >= exact_scores[-1] - 1e-6).sum())
+            n_candidates += len(index.candidates(vector, n_probes))
+
+        results.append({
+            'n_probes': n_probes,
+            'recall': hits / (k * len(queries)),
+            'ann_ms': ann_time / len(queries) * 1000,
+            'exact_ms': exact_time / len(queries) * 1000,
+            'candidates': n_candidates / len(queries)
+        })
+
+    return results
+
+
+# Test / benchmark: python ann_index.py [số quán giả lập]
+if __name__ == "__main__":
+    X = load_and_prepare_data()
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else len(X)
+
+    if n_rows == len(X):
+        feature_matrix = build_feature_matrix(X)
+    else:
+        feature_matrix = synthesize_feature_matrix(X, n_rows)
+
+    start = time.perf_counter()
+    index = build_lsh_index(feature_matrix)
+    print(f"Built LSH index: {n_rows} restaurants, {index.n_tables} tables × {index.n_bits} bits "
+          f"in {time.perf_counter() - start:.2f}s")
+
+    for result in benchmark(index):
+        print(f"n_probes={result['n_probes']}: recall@10={result['recall']:.3f}, "
+              f"ann={result['ann_ms']:.2f} ms, exact={result['exact_ms']:.2f} ms, "
+              f"candidates={result['candidates']:.0f}")
+
+    # Upsert một quán có nhãn mới (quận / món chưa có trong vocabulary)
+    if n_rows == len(X):
+        from Content_based_Filtering_model import build_similarity_model
+
+        model = build_similarity_model(X, mode='ann')
+        record = dict(X.iloc[0], id=int(X['id'].max()) + 1,
+                      district='Quận Mới', food_categories=['Món Mới'])
+        row, is_new = model.upsert(record)
+        rows, scores = model.top_neighbors(row, 5)
+        print(f"Upsert with new labels: row {row}, {model.features.shape[1]} features, "
+              f"planes {model.planes.shape}, top-5 scores {np.round(scores, 3).tolist()}")
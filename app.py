@@ -1,9 +1,10 @@
 import streamlit as st
-import pandas as pd
-import itertools
+import numpy as np
 import re
-import json
 import pydeck as pdk
+from datetime import datetime
+
+from catalog import load_compact_catalog
 
 # =======================
 # Page config
@@ -29,13 +30,19 @@ def district_sort_key(name):
 # =======================
 # Load data
 # =======================
-@st.cache_data
+# Chỉ đọc các cột page này dùng (bundle nhị phân đọc theo cột)
+APP_COLUMNS = [
+    "name", "address", "district", "category", "food_categories", "style",
+    "average_rating", "average_price_min", "avarage_price_max", "latitude", "longitude",
+    "main_opening_hour", "main_closing_hour", "sub_opening_hour", "sub_closing_hour"
+]
+
+
+@st.cache_resource
 def load_data():
-    with open("./restaurants_with_coords.json", "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return pd.DataFrame(data)
+    return load_compact_catalog("./restaurants_with_coords.json", columns=APP_COLUMNS)
 
-df = load_data()
+catalog = load_data()
 
 # =======================
 # Sidebar – Filters
@@ -43,35 +50,33 @@ df = load_data()
 st.sidebar.header("🔍 Bộ lọc")
 
 districts = ["Tất cả"] + sorted(
-    df[df["district"].notna()]["district"].unique().tolist(),
+    catalog.labels("district"),
     key=district_sort_key
 )
 
-# flatten food_categories
-all_categories = list(
-    set(itertools.chain.from_iterable(df["food_categories"]))
-)
-categories = ["Tất cả"] + sorted(all_categories)
+# food_categories đã được mã hóa (nhãn không trùng)
+categories = ["Tất cả"] + sorted(catalog.labels("food_categories"))
 
 selected_district = st.sidebar.selectbox("Quận", districts)
 selected_category = st.sidebar.selectbox("Loại món", categories)
+open_now = st.sidebar.checkbox("Đang mở cửa")
 
 # =======================
 # Filter data
 # =======================
-filtered_df = df.copy()
+# So sánh code số nguyên, chỉ giải mã các dòng được giữ lại
+mask = np.ones(len(catalog), dtype=bool)
 
 if selected_district != "Tất cả":
-    filtered_df = filtered_df[
-        filtered_df["district"] == selected_district
-    ]
+    mask &= catalog.equals_any("district", [selected_district])
 
 if selected_category != "Tất cả":
-    filtered_df = filtered_df[
-        filtered_df["food_categories"].apply(
-            lambda x: selected_category in x
-        )
-    ]
+    mask &= catalog.contains_any("food_categories", [selected_category])
+
+if open_now:
+    mask &= catalog.open_at(datetime.now())
+
+filtered_df = catalog.take(mask)
 
 # =======================
 # MAIN UI
@@ -0,0 +1,541 @@
+# catalog.py
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from filter_index import OpeningHoursIndex, PriceIndex
+from model_cache import file_fingerprint, share_numeric_columns, write_bundle
+
+# =======================
+# Kiểu dữ liệu từng cột
+# =======================
+# Cột chuỗi ít giá trị -> pandas categorical (code int8/int16 + bảng nhãn)
+CATEGORICAL_COLUMNS = ['district', 'category', 'city']
+
+# Cột list -> CSR (offsets + code int16)
+LIST_COLUMNS = ['food_categories', 'style', 'appropriate', 'suitable_time']
+
+# Giá (VNĐ, số nguyên) -> int32
+INT32_COLUMNS = [
+    'average_price_min', 'avarage_price_max',
+    'comment_quantity', 'marvelous_comment', 'good_comment', 'ok_comment', 'awful_comment'
+]
+
+# Điểm đánh giá (0-10) -> float32
+FLOAT32_COLUMNS = [
+    'average_rating', 'quality_rating', 'service_rating',
+    'price_rating', 'location_rating', 'space_rating'
+]
+
+
+def compact_frame(df):
+    """
+    Đổi các cột vô hướng sang kiểu gọn: categorical, int32, float32
+    (cột list giữ nguyên). Gọi sau khi fillna.
+
+    Returns:
+        DataFrame mới, cùng cột / thứ tự dòng
+    """
+    df = df.copy()
+
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+
+    for col in INT32_COLUMNS:
+        if col in df.columns and pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = df[col].fillna(0).astype(np.int32)
+
+    for col in FLOAT32_COLUMNS:
+        if col in df.columns and pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = df[col].astype(np.float32)
+
+    return df
+
+
+def widen_floats(df):
+    """
+    Đổi ngược các cột float32 sang float64 để hiển thị (f"{rating}/10"
+    ra "7.8" thay vì "7.800000190734863"). Điểm gốc có 1 chữ số thập
+    phân nên làm tròn 6 chữ số là khôi phục đúng giá trị ban đầu.
+    Sửa tại chỗ, trả về chính df
+    """
+    for col in df.columns:
+        if df[col].dtype == np.float32:
+            df[col] = np.round(df[col].to_numpy(dtype=np.float64), 6)
+    return df
+
+
+# =======================
+# Cột list dạng CSR
+# =======================
+class ListColumn:
+    """
+    Cột list lưu dạng CSR: nhãn của dòng i là
+    labels[codes[offsets[i]:offsets[i + 1]]]
+    - offsets: (N+1) int32
+    - codes: int16 (int32 nếu nhiều hơn 32767 nhãn)
+    - labels: np.ndarray object, sort tăng dần
+    """
+
+    def __init__(self, offsets, codes, labels):
+        self.offsets = offsets
+        self.codes = codes
+        self.labels = labels
+        self._lookup = {label: code for code, label in enumerate(labels)}
+
+    @classmethod
+    def from_lists(cls, values):
+        """
+        Mã hóa một cột list (vd: df['food_categories'])
+        """
+        column = pd.Series(list(values), dtype=object)
+        lengths = column.map(lambda value: len(value) if isinstance(value, list) else 0).to_numpy()
+
+        exploded = column[lengths > 0].explode().to_numpy()
+        codes, labels = pd.factorize(exploded, sort=True)
+
+        offsets = np.zeros(len(column) + 1, dtype=np.int32)
+        np.cumsum(lengths, out=offsets[1:])
+
+        code_dtype = np.int16 if len(labels) <= np.iinfo(np.int16).max else np.int32
+        return cls(offsets, codes.astype(code_dtype), np.asarray(labels, dtype=object))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        return self.labels[self.codes[self.offsets[row]:self.offsets[row + 1]]].tolist()
+
+    def contains_any(self, values):
+        """
+        Mask boolean: dòng có ít nhất một nhãn trong values
+        (so sánh code số nguyên, không duyệt list Python)
+        """
+        wanted = [self._lookup[value] for value in values if value in self._lookup]
+        mask = np.zeros(len(self), dtype=bool)
+        if not wanted:
+            return mask
+
+        hit = np.isin(self.codes, wanted)
+        rows = np.repeat(np.arange(len(self), dtype=np.int32), np.diff(self.offsets))
+        mask[rows[hit]] = True
+        return mask
+
+    def to_lists(self, rows):
+        """
+        Giải mã các dòng rows thành list Python (gom code một lần rồi cắt)
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = np.asarray(self.offsets[rows], dtype=np.int64)
+        lengths = np.asarray(self.offsets[rows + 1], dtype=np.int64) - starts
+
+        ends = np.cumsum(lengths)
+        positions = np.repeat(starts - (ends - lengths), lengths) + np.arange(ends[-1] if len(ends) else 0)
+        flat = self.labels[np.asarray(self.codes)[positions]].tolist()
+
+        bounds = [0] + ends.tolist()
+        return [flat[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+    def nbytes(self):
+        return self.offsets.nbytes + self.codes.nbytes + sum(len(label) for label in self.labels)
+
+
+# =======================
+# Compact catalog
+# =======================
+class CompactCatalog:
+    """
+    Catalog gọn cho các page Streamlit:
+    - frame: DataFrame các cột vô hướng (categorical, int32, float32...)
+    - lists: dict tên cột -> ListColumn
+
+    Mọi filter là phép so sánh số nguyên / float vectorized, chỉ các dòng
+    cần hiển thị mới được giải mã lại thành DataFrame đầy đủ (take).
+    """
+
+    def __init__(self, frame, lists, columns):
+        self.frame = frame
+        self.lists = lists
+        self.columns = columns
+        self._hours = None
+        self._prices = None
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Tạo CompactCatalog từ DataFrame catalog gốc
+        """
+        lists = {col: ListColumn.from_lists(df[col]) for col in LIST_COLUMNS if col in df.columns}
+        frame = compact_frame(df.drop(columns=list(lists)))
+        return cls(frame, lists, list(df.columns))
+
+    @classmethod
+    def from_bundle(cls, path, columns=None):
+        """
+        Tạo CompactCatalog trực tiếp từ bundle (xem convert_catalog):
+        cột số, code categorical và CSR của cột list đều là memmap, không copy
+        """
+        n_rows, raw = read_bundle(path, columns)
+
+        lists = {}
+        series = {}
+        for name, (kind, payload) in raw.items():
+            if kind == 'list':
+                lists[name] = ListColumn(*payload)
+            else:
+                series[name] = _to_series(kind, payload)
+
+        frame = pd.DataFrame(series, index=pd.RangeIndex(n_rows), copy=False)
+        return cls(frame, lists, list(raw))
+
+    def __len__(self):
+        return len(self.frame)
+
+    def labels(self, col):
+        """
+        Các giá trị khác nhau của một cột categorical hoặc cột list
+        """
+        if col in self.lists:
+            return self.lists[col].labels.tolist()
+        return self.frame[col].cat.categories.tolist()
+
+    def equals_any(self, col, values):
+        """
+        Mask boolean: giá trị cột categorical col nằm trong values
+        """
+        column = self.frame[col]
+        wanted = column.cat.categories.get_indexer(list(values))
+        return np.isin(column.cat.codes.to_numpy(), wanted[wanted >= 0])
+
+    def contains_any(self, col, values):
+        """
+        Mask boolean: cột list col chứa ít nhất một giá trị trong values
+        """
+        return self.lists[col].contains_any(values)
+
+    def price_overlap(self, lo, hi):
+        """
+        Mask boolean: khoảng giá [min, max] của quán giao với [lo, hi]
+        """
+        if self._prices is None:
+            self._prices = PriceIndex(self.frame['average_price_min'].to_numpy(),
+                                      self.frame['avarage_price_max'].to_numpy())
+        return self._prices.mask(lo, hi)
+
+    def open_at(self, when, include_unknown=False):
+        """
+        Mask boolean: quán mở cửa tại thời điểm when (datetime / time / phút
+        trong ngày). Index giờ mở cửa được dựng lần đầu gọi
+        """
+        if self._hours is None:
+            self._hours = OpeningHoursIndex.build(self.frame)
+        return self._hours.open_at(when, include_unknown)
+
+    def take(self, rows):
+        """
+        Giải mã các dòng rows (vị trí hoặc mask boolean) thành DataFrame
+        đầy đủ cột như catalog gốc, index = vị trí dòng
+        """
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+
+        df = self.frame.iloc[rows].copy()
+        for col, column in self.lists.items():
+            df[col] = column.to_lists(rows)
+
+        df.index = rows
+        return widen_floats(df[self.columns])
+
+    def nlargest(self, n, col, rows=None):
+        """
+        n dòng có giá trị col lớn nhất (giống DataFrame.nlargest, trùng giá
+        trị thì giữ thứ tự dòng), chỉ trong rows / mask nếu có
+        """
+        if rows is None:
+            rows = np.arange(len(self))
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+
+        values = self.frame[col].to_numpy()[rows]
+        order = np.argsort(-values, kind='stable')[:n]
+        return self.take(rows[order])
+
+    def memory_usage(self):
+        """
+        Tổng số byte (deep) của frame + các cột list
+        """
+        return int(self.frame.memory_usage(deep=True).sum()) + sum(
+            column.nbytes() for column in self.lists.values()
+        )
+
+
+# =======================
+# Binary columnar bundle
+# =======================
+# Bundle nằm cạnh file JSON: restaurants_with_coords.json -> restaurants_with_coords.catalog/
+BUNDLE_SUFFIX = '.catalog'
+
+# Tăng khi đổi định dạng bundle (bundle cũ bị coi là hết hạn)
+BUNDLE_VERSION = 1
+
+
+def bundle_path(json_path):
+    return os.path.splitext(json_path)[0] + BUNDLE_SUFFIX
+
+
+def convert_catalog(json_path, out_path=None):
+    """
+    Ghi catalog JSON thành bundle nhị phân dạng cột: mỗi cột là một hoặc
+    vài file .npy (memory-map được), meta.json ghi kiểu cột, nhãn và
+    fingerprint của file nguồn
+
+    - cột số: .npy (giá -> int32, điểm -> float32)
+    - categorical: codes int16 + nhãn trong meta
+    - cột list: offsets int32 + codes int16 + nhãn trong meta (CSR)
+    - cột chuỗi: UTF-8 nối liền (uint8) + offsets int64 (+ valid nếu có null)
+
+    Args:
+        json_path: File JSON nguồn
+        out_path: Thư mục bundle (mặc định bundle_path(json_path))
+
+    Returns:
+        Đường dẫn bundle
+    """
+    out_path = out_path or bundle_path(json_path)
+
+    with open(json_path, "r", encoding="utf-8") as f:
+        df = pd.DataFrame(json.load(f))
+
+    arrays = {}
+
+    def _save(name, array):
+        arrays[name] = array
+
+    columns = []
+    for col in df.columns:
+        values = df[col]
+
+        if col in LIST_COLUMNS:
+            column = ListColumn.from_lists(values)
+            _save(f"{col}.offsets", column.offsets)
+            _save(f"{col}.codes", column.codes)
+            columns.append({"name": col, "kind": "list", "labels": column.labels.tolist()})
+
+        elif col in CATEGORICAL_COLUMNS:
+            codes, labels = pd.factorize(values.to_numpy(dtype=object), sort=True)
+            _save(col, codes.astype(np.int16))
+            columns.append({"name": col, "kind": "category", "labels": list(labels)})
+
+        elif pd.api.types.is_numeric_dtype(values):
+            if col in INT32_COLUMNS:
+                array = values.fillna(0).to_numpy().astype(np.int32)
+            elif col in FLOAT32_COLUMNS:
+                array = values.to_numpy().astype(np.float32)
+            else:
+                array = values.to_numpy()
+            _save(col, array)
+            columns.append({"name": col, "kind": "numeric"})
+
+        else:
+            valid = values.notna().to_numpy()
+            encoded = [str(value).encode("utf-8") if ok else b"" for value, ok in zip(values, valid)]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(value) for value in encoded], out=offsets[1:])
+            _save(f"{col}.data", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+            _save(f"{col}.offsets", offsets)
+            if not valid.all():
+                _save(f"{col}.valid", valid)
+            columns.append({"name": col, "kind": "string", "has_nulls": bool(not valid.all())})
+
+    meta = {
+        "version": BUNDLE_VERSION,
+        "source": file_fingerprint([json_path]),
+        "n_rows": len(df),
+        "columns": columns
+    }
+    # Thay bundle cũ (nếu có) bằng bundle mới
+    return write_bundle(out_path, arrays, meta)
+
+
+def _read_meta(path):
+    try:
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_bundle(path, columns=None, mmap_mode='r'):
+    """
+    Đọc các cột của bundle (chỉ mở file của những cột được chọn)
+
+    Args:
+        path: Thư mục bundle
+        columns: List tên cột cần đọc (mặc định tất cả, cột không có bị bỏ qua)
+        mmap_mode: Truyền cho np.load ('r' = memory-map read-only)
+
+    Returns:
+        (n_rows, dict tên cột -> (kind, payload)) theo thứ tự cột của bundle
+    """
+    meta = _read_meta(path)
+    wanted = None if columns is None else set(columns)
+
+    def _load(name):
+        return np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+
+    raw = {}
+    for column in meta["columns"]:
+        name, kind = column["name"], column["kind"]
+        if wanted is not None and name not in wanted:
+            continue
+
+        if kind == 'list':
+            payload = (_load(f"{name}.offsets"), _load(f"{name}.codes"),
+                       np.asarray(column["labels"], dtype=object))
+        elif kind == 'category':
+            payload = (_load(name), column["labels"])
+        elif kind == 'string':
+            valid = _load(f"{name}.valid") if column.get("has_nulls") else None
+            payload = (_load(f"{name}.data"), _load(f"{name}.offsets"), valid)
+        else:
+            payload = _load(name)
+
+        raw[name] = (kind, payload)
+
+    return meta["n_rows"], raw
+
+
+def _to_series(kind, payload):
+    """
+    Payload của một cột (không phải list) -> dữ liệu cho DataFrame
+    """
+    if kind == 'category':
+        codes, labels = payload
+        return pd.Categorical.from_codes(codes, categories=labels)
+
+    if kind == 'string':
+        data, offsets, valid = payload
+        blob = data.tobytes()
+        values = [blob[lo:hi].decode("utf-8") for lo, hi in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+        if valid is not None:
+            values = [value if ok else None for value, ok in zip(values, valid)]
+        return values
+
+    return payload
+
+
+def find_bundle(json_path, convert=True):
+    """
+    Bundle còn hợp lệ (cùng fingerprint nguồn, cùng BUNDLE_VERSION) của
+    json_path; nếu chưa có / hết hạn và convert=True thì tạo mới
+
+    Returns:
+        Đường dẫn bundle, hoặc None (vd: thư mục read-only) -> đọc JSON
+    """
+    if os.path.isdir(json_path):
+        return json_path
+
+    path = bundle_path(json_path)
+    meta = _read_meta(path)
+    if meta is not None and meta.get("version") == BUNDLE_VERSION \
+            and meta.get("source") == file_fingerprint([json_path]):
+        return path
+
+    if not convert or not os.path.exists(json_path):
+        return None
+
+    try:
+        return convert_catalog(json_path, path)
+    except OSError:
+        return None
+
+
+def read_catalog_frame(json_path, columns=None, mmap=True):
+    """
+    Load catalog thành DataFrame (thay cho pd.read_json / json.load):
+    đọc từ bundle nhị phân nếu có (tự tạo lần đầu), chỉ các cột cần
+
+    Args:
+        json_path: File JSON nguồn (hoặc thư mục bundle)
+        columns: List cột cần đọc (mặc định tất cả)
+        mmap: Cột số là memmap read-only (dùng chung page cache giữa các process)
+
+    Returns:
+        DataFrame, cột list là list Python như khi đọc JSON
+    """
+    path = find_bundle(json_path)
+
+    if path is None:
+        with open(json_path, "r", encoding="utf-8") as f:
+            df = pd.DataFrame(json.load(f))
+        return df if columns is None else df[[col for col in columns if col in df.columns]]
+
+    n_rows, raw = read_bundle(path, columns, mmap_mode='r' if mmap else None)
+
+    data = {}
+    for name, (kind, payload) in raw.items():
+        if kind == 'list':
+            data[name] = ListColumn(*payload).to_lists(range(n_rows))
+        else:
+            data[name] = _to_series(kind, payload)
+
+    return widen_floats(pd.DataFrame(data, index=pd.RangeIndex(n_rows), copy=False))
+
+
+def load_catalog(json_path, mmap=True, columns=None):
+    """
+    Load catalog thành DataFrame đầy đủ cho các page, cột số được
+    memory-map (từ bundle, hoặc artifact cache nếu phải đọc JSON)
+
+    Args:
+        json_path: File JSON nguồn
+        mmap: False để giữ toàn bộ DataFrame trong RAM
+        columns: List cột cần đọc (mặc định tất cả)
+
+    Returns:
+        DataFrame
+    """
+    if find_bundle(json_path) is not None or not mmap:
+        return read_catalog_frame(json_path, columns, mmap)
+
+    df = read_catalog_frame(json_path, columns, mmap=False)
+    kind = f"catalog-{os.path.splitext(os.path.basename(json_path))[0]}"
+    return share_numeric_columns(df, kind, file_fingerprint([json_path]))
+
+
+def load_compact_catalog(json_path, mmap=True, columns=None):
+    """
+    Load catalog thành CompactCatalog: từ bundle nhị phân nếu có (zero-copy),
+    ngược lại parse JSON rồi memory-map cột số qua artifact cache
+
+    Args:
+        json_path: File JSON nguồn
+        mmap: False để giữ toàn bộ trong RAM
+        columns: List cột cần đọc (mặc định tất cả)
+
+    Returns:
+        CompactCatalog
+    """
+    path = find_bundle(json_path)
+    if path is not None and mmap:
+        return CompactCatalog.from_bundle(path, columns)
+
+    catalog = CompactCatalog.from_frame(read_catalog_frame(json_path, columns, mmap=False))
+
+    if mmap:
+        kind = f"compact-{os.path.splitext(os.path.basename(json_path))[0]}"
+        catalog.frame = share_numeric_columns(catalog.frame, kind, file_fingerprint([json_path]))
+
+    return catalog
+
+
+# Chuyển đổi: python catalog.py restaurants.json restaurants_with_coords.json ...
+if __name__ == "__main__":
+    for source in sys.argv[1:] or ["./restaurants_with_coords.json"]:
+        print(f"{source} -> {convert_catalog(source)}")
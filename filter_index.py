@@ -0,0 +1,371 @@
+# filter_index.py
+import re
+from datetime import datetime, time
+
+import numpy as np
+import pandas as pd
+
+# =======================
+# Cấu hình mặc định
+# =======================
+# Các cột dùng để lọc (cột list hoặc giá trị đơn)
+FILTER_FIELDS = ['district', 'food_categories', 'style']
+
+# Cận dưới của từng bucket giá (VNĐ), bucket cuối không giới hạn trên
+PRICE_BUCKETS = [0, 30000, 50000, 100000, 200000, 500000]
+
+# Các cặp cột giờ mở / đóng cửa (ca chính, ca phụ)
+HOUR_COLUMNS = [('main_opening_hour', 'main_closing_hour'), ('sub_opening_hour', 'sub_closing_hour')]
+
+# Độ dài một slot của bitset giờ mở cửa (phút)
+SLOT_MINUTES = 15
+N_SLOTS = 24 * 60 // SLOT_MINUTES
+
+
+# =======================
+# Bitset masks
+# =======================
+class FilterIndex:
+    """
+    Bitset (np.packbits, 1 bit/quán) dựng sẵn cho từng giá trị của
+    district, food_categories, style và từng bucket giá. Một filter là
+    OR các bitset trong cùng cột rồi AND giữa các cột, chỉ unpack một lần
+    ở cuối -> lọc trước khi xếp hạng similarity, không cần pandas apply.
+    Khoảng giá tùy ý đi qua PriceIndex, giờ mở cửa qua OpeningHoursIndex.
+
+    Vị trí bit là vị trí dòng, trùng với thứ tự dòng của X / SimilarityIndex.
+    """
+
+    def __init__(self, n_rows, bitsets, prices, hours=None):
+        self.n_rows = n_rows
+        self.bitsets = bitsets
+        self.prices = prices
+        self.hours = hours
+
+    @classmethod
+    def build(cls, X):
+        """
+        Dựng FilterIndex từ DataFrame (output của load_and_prepare_data)
+        """
+        n_rows = len(X)
+        bitsets = {}
+
+        for field in FILTER_FIELDS:
+            if field not in X.columns:
+                bitsets[field] = {}
+                continue
+
+            exploded = pd.Series(list(X[field]), dtype=object).explode()
+            keep = exploded.notna().to_numpy() & (exploded != '').to_numpy()
+            rows = exploded.index.to_numpy()[keep]
+            codes, uniques = pd.factorize(exploded.to_numpy()[keep])
+
+            bitsets[field] = {}
+            for code, value in enumerate(uniques):
+                bitsets[field][value] = _pack_rows(rows[codes == code], n_rows)
+
+        price_min = _column(X, 'average_price_min', n_rows)
+        price_max = _column(X, 'avarage_price_max', n_rows)
+
+        # Quán thuộc mọi bucket mà khoảng giá [min, max] của quán giao với bucket
+        bounds = PRICE_BUCKETS + [np.inf]
+        bitsets['price_bucket'] = {
+            lo: np.packbits((price_min < hi) & (price_max >= lo))
+            for lo, hi in zip(bounds[:-1], bounds[1:])
+        }
+
+        return cls(n_rows, bitsets, PriceIndex(price_min, price_max), OpeningHoursIndex.build(X))
+
+    def values(self, field):
+        """
+        Các giá trị có bitset của field
+        """
+        return list(self.bitsets.get(field, {}))
+
+    def _any_of(self, field, values):
+        """
+        OR các bitset của values trong field (giá trị không có -> 0)
+        """
+        table = self.bitsets.get(field, {})
+        bits = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+        for value in values:
+            if value in table:
+                bits |= table[value]
+        return bits
+
+    def mask(self, district=None, food_categories=None, style=None,
+             price_bucket=None, price_range=None, open_at=None):
+        """
+        Tính mask boolean theo filter: mỗi tham số là list giá trị
+        (OR trong cùng cột), các tham số khác None được AND với nhau
+
+        Args:
+            district, food_categories, style: List giá trị cần giữ
+            price_bucket: List cận dưới bucket (phần tử của PRICE_BUCKETS)
+            price_range: (lo, hi) - giữ quán có khoảng giá giao với [lo, hi]
+            open_at: datetime / time / phút trong ngày - giữ quán đang mở cửa
+
+        Returns:
+            np.ndarray bool shape (n_rows,), hoặc None nếu không có filter nào
+        """
+        clauses = [
+            (field, values) for field, values in [
+                ('district', district),
+                ('food_categories', food_categories),
+                ('style', style),
+                ('price_bucket', price_bucket)
+            ] if values is not None
+        ]
+
+        mask = None
+        if clauses:
+            bits = None
+            for field, values in clauses:
+                field_bits = self._any_of(field, values)
+                bits = field_bits if bits is None else bits & field_bits
+            mask = np.unpackbits(bits, count=self.n_rows).astype(bool)
+
+        if price_range is not None:
+            price_mask = self.prices.mask(*price_range)
+            mask = price_mask if mask is None else mask & price_mask
+
+        if open_at is not None:
+            if mask is None:
+                return self.hours.open_at(open_at)
+            mask &= self.hours.open_at(open_at)
+
+        return mask
+
+
+# =======================
+# Khoảng giá
+# =======================
+class PriceIndex:
+    """
+    Index khoảng giá [price_min, price_max] của từng quán, chia theo lớp
+    độ rộng khoảng (max - min trong [2^c, 2^(c+1))):
+    - rows: vị trí dòng, sort theo (lớp, price_min)
+    - keys: lớp · span + (price_min - offset), tăng dần -> một lần
+      searchsorted cho mọi lớp
+    - maxs: price_max tương ứng với rows
+    - widths: độ rộng lớn nhất của từng lớp
+
+    Quán giao với [lo, hi] <=> price_min <= hi và price_max >= lo. Trong một
+    lớp, price_max >= lo kéo theo price_min >= lo - width, nên chỉ cần lấy
+    đoạn price_min trong [lo - width, hi] rồi kiểm tra price_max:
+    O(số lớp · log N + k), các quán bị quét thừa chỉ là quán cùng lớp nằm
+    sát bên trái lo.
+    """
+
+    def __init__(self, price_min, price_max):
+        price_min = np.asarray(price_min, dtype=np.float64)
+        price_max = np.maximum(np.asarray(price_max, dtype=np.float64), price_min)
+
+        self.n_rows = len(price_min)
+        self.offset = price_min.min() if self.n_rows else 0.0
+        self.span = (price_min.max() - self.offset + 2) if self.n_rows else 2.0
+
+        width = price_max - price_min
+        width_class = np.floor(np.log2(width + 1)).astype(np.int64)
+        classes, class_rank = np.unique(width_class, return_inverse=True)
+
+        keys = class_rank * self.span + (price_min - self.offset)
+        order = np.argsort(keys, kind='stable')
+
+        self.rows = order.astype(np.int32)
+        self.keys = keys[order]
+        self.maxs = price_max[order]
+        self.widths = np.zeros(len(classes))
+        np.maximum.at(self.widths, class_rank, width)
+
+    def rows_overlapping(self, lo, hi):
+        """
+        Vị trí dòng các quán có khoảng giá giao với [lo, hi]
+        (theo thứ tự lớp / price_min, không sort theo dòng)
+        """
+        base = np.arange(len(self.widths)) * self.span
+        lo_keys = base + np.clip(lo - self.widths - self.offset, 0, self.span - 1)
+        hi_keys = base + np.clip(hi - self.offset, -1, self.span - 1)
+
+        starts = np.searchsorted(self.keys, lo_keys, side='left')
+        lengths = np.maximum(np.searchsorted(self.keys, hi_keys, side='right') - starts, 0)
+
+        # Ghép các đoạn [start, start + length) thành một mảng chỉ số
+        total = int(lengths.sum())
+        if total == 0:
+            return np.array([], dtype=np.int32)
+        positions = np.arange(total) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+
+        return self.rows[positions[self.maxs[positions] >= lo]]
+
+    def count(self, lo, hi):
+        """
+        Số quán có khoảng giá giao với [lo, hi]
+        """
+        return len(self.rows_overlapping(lo, hi))
+
+    def mask(self, lo, hi):
+        """
+        Mask boolean các quán có khoảng giá giao với [lo, hi]
+        """
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[self.rows_overlapping(lo, hi)] = True
+        return mask
+
+
+# =======================
+# Giờ mở cửa
+# =======================
+def parse_minutes(value):
+    """
+    "HH:MM" -> phút trong ngày (0..1440), None nếu rỗng / không đọc được.
+    "23:59" được coi là hết ngày (1440)
+    """
+    if not isinstance(value, str):
+        return None
+
+    match = re.fullmatch(r'\s*(\d{1,2})[:hH](\d{2})\s*', value)
+    if not match:
+        return None
+
+    hour, minute = int(match.group(1)), int(match.group(2))
+    if hour > 24 or minute > 59:
+        return None
+
+    minutes = min(hour * 60 + minute, 24 * 60)
+    return 24 * 60 if minutes == 24 * 60 - 1 else minutes
+
+
+def opening_intervals(opening, closing):
+    """
+    Khoảng [start, end) phút trong ngày mà quán mở cửa. Giờ đóng nhỏ hơn
+    giờ mở = đóng sau nửa đêm -> tách làm hai khoảng; mở = đóng -> cả ngày
+
+    Returns:
+        List (start, end), rỗng nếu thiếu giờ
+    """
+    start, end = parse_minutes(opening), parse_minutes(closing)
+    if start is None or end is None:
+        return []
+
+    if start == end or (start == 0 and end == 24 * 60):
+        return [(0, 24 * 60)]
+    if end > start:
+        return [(start, end)]
+
+    # Qua nửa đêm
+    intervals = [(0, end)] if end > 0 else []
+    if start < 24 * 60:
+        intervals.append((start, 24 * 60))
+    return intervals
+
+
+def _minute_of_day(when):
+    if isinstance(when, (datetime, time)):
+        return when.hour * 60 + when.minute
+    return int(when) % (24 * 60)
+
+
+class OpeningHoursIndex:
+    """
+    Index giờ mở cửa dựng một lần từ các cột main_/sub_ opening/closing:
+    - intervals: (interval_rows, starts, ends) các khoảng [start, end) phút
+      của từng quán (ca chính, ca phụ, đã tách khoảng qua nửa đêm)
+    - full: bitset mỗi slot SLOT_MINUTES phút, quán mở suốt cả slot
+    - partial: bitset mỗi slot, quán chỉ mở một phần slot (mở / đóng giữa slot)
+    - known: bitset các quán có giờ mở cửa
+
+    open_at(T) = full[slot] | (partial[slot] & kiểm tra chính xác trên các
+    khoảng của quán đó), hầu hết chỉ là một lần tra bitset.
+    """
+
+    def __init__(self, n_rows, full, partial, known, interval_rows, starts, ends):
+        self.n_rows = n_rows
+        self.full = full
+        self.partial = partial
+        self.known = known
+        self.interval_rows = interval_rows
+        self.starts = starts
+        self.ends = ends
+
+    @classmethod
+    def build(cls, X):
+        """
+        Dựng OpeningHoursIndex từ DataFrame có các cột giờ (thiếu cột thì bỏ qua)
+        """
+        n_rows = len(X)
+        rows, starts, ends = [], [], []
+
+        for opening_col, closing_col in HOUR_COLUMNS:
+            if opening_col not in X.columns or closing_col not in X.columns:
+                continue
+
+            for row, (opening, closing) in enumerate(zip(X[opening_col], X[closing_col])):
+                for start, end in opening_intervals(opening, closing):
+                    rows.append(row)
+                    starts.append(start)
+                    ends.append(end)
+
+        interval_rows = np.array(rows, dtype=np.int32)
+        starts = np.array(starts, dtype=np.int16)
+        ends = np.array(ends, dtype=np.int16)
+
+        # Slot s = [s·SLOT, (s+1)·SLOT): mở cả slot nếu khoảng phủ trọn slot,
+        # mở một phần nếu khoảng chỉ giao với slot
+        slot_starts = np.arange(N_SLOTS) * SLOT_MINUTES
+        slot_ends = slot_starts + SLOT_MINUTES
+        covers = (starts[np.newaxis, :] <= slot_starts[:, np.newaxis]) & \
+                 (ends[np.newaxis, :] >= slot_ends[:, np.newaxis])
+        overlaps = (starts[np.newaxis, :] < slot_ends[:, np.newaxis]) & \
+                   (ends[np.newaxis, :] > slot_starts[:, np.newaxis])
+
+        full = np.zeros((N_SLOTS, n_rows), dtype=bool)
+        partial = np.zeros((N_SLOTS, n_rows), dtype=bool)
+        for slot in range(N_SLOTS):
+            full[slot, interval_rows[covers[slot]]] = True
+            partial[slot, interval_rows[overlaps[slot]]] = True
+        partial &= ~full
+
+        known = np.zeros(n_rows, dtype=bool)
+        known[interval_rows] = True
+
+        return cls(n_rows, np.packbits(full, axis=1), np.packbits(partial, axis=1),
+                   np.packbits(known), interval_rows, starts, ends)
+
+    def open_at(self, when, include_unknown=False):
+        """
+        Mask boolean các quán mở cửa tại thời điểm when
+
+        Args:
+            when: datetime / time / phút trong ngày
+            include_unknown: True để giữ cả các quán không có giờ mở cửa
+
+        Returns:
+            np.ndarray bool shape (n_rows,)
+        """
+        minute = _minute_of_day(when)
+        slot = minute // SLOT_MINUTES
+
+        mask = np.unpackbits(self.full[slot], count=self.n_rows).astype(bool)
+
+        partial = np.unpackbits(self.partial[slot], count=self.n_rows).astype(bool)
+        if partial.any():
+            hits = partial[self.interval_rows] & (self.starts <= minute) & (minute < self.ends)
+            mask[self.interval_rows[hits]] = True
+
+        if include_unknown:
+            mask |= ~np.unpackbits(self.known, count=self.n_rows).astype(bool)
+
+        return mask
+
+
+def _pack_rows(rows, n_rows):
+    mask = np.zeros(n_rows, dtype=bool)
+    mask[rows] = True
+    return np.packbits(mask)
+
+
+def _column(X, col, n_rows):
+    if col not in X.columns:
+        return np.zeros(n_rows)
+    return np.asarray(X[col], dtype=np.float64)
@@ -0,0 +1,266 @@
+# model_cache.py
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, issparse
+
+# =======================
+# Cấu hình cache
+# =======================
+# Thư mục lưu artifact (dùng chung cho mọi process Streamlit)
+CACHE_DIR = os.environ.get("MODEL_CACHE_DIR", "./.model_cache")
+
+# Tăng khi đổi định dạng artifact để bỏ qua toàn bộ cache cũ
+CACHE_VERSION = 4
+
+
+# =======================
+# Fingerprint nguồn dữ liệu
+# =======================
+def file_fingerprint(paths, params=None):
+    """
+    Hash nội dung các file nguồn (và tham số build) thành key của cache
+
+    Args:
+        paths: List đường dẫn file nguồn (file không tồn tại vẫn được tính)
+        params: Dict tham số ảnh hưởng tới kết quả build (mode, k, weights...)
+
+    Returns:
+        Chuỗi hex sha256
+    """
+    digest = hashlib.sha256()
+
+    for path in paths:
+        digest.update(path.encode("utf-8"))
+
+        if not os.path.exists(path):
+            digest.update(b"<missing>")
+            continue
+
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+
+    if params is not None:
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+def file_stats(paths):
+    """
+    Kích thước + mtime của các file nguồn: kiểm tra nhanh (không đọc nội
+    dung) xem file có đổi kể từ lần build trước không
+
+    Returns:
+        List [path, size, mtime_ns] (None nếu file không tồn tại)
+    """
+    stats = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stats.append([path, stat.st_size, stat.st_mtime_ns])
+        except OSError:
+            stats.append([path, None, None])
+    return stats
+
+
+# =======================
+# Ghi bundle
+# =======================
+def write_bundle(path, arrays, meta, replace=True):
+    """
+    Ghi một thư mục bundle: mỗi array một file {tên}.npy (memory-map được)
+    + meta.json ghi sau cùng
+
+    Ghi vào thư mục tạm rồi rename, nên process khác không bao giờ đọc
+    phải bundle ghi dở.
+
+    Args:
+        path: Thư mục bundle
+        arrays: Dict tên -> np.ndarray
+        meta: Dict JSON-serializable, ghi thành meta.json
+        replace: False để giữ bundle đã có (vd: process khác vừa ghi cùng key)
+
+    Returns:
+        path
+
+    Raises:
+        OSError nếu không ghi được (thư mục tạm đã được xóa)
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+
+    try:
+        os.makedirs(tmp_path, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), np.asarray(array))
+
+        # meta.json ghi sau cùng
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        if not os.path.exists(path):
+            os.rename(tmp_path, path)
+        elif replace:
+            old_path = f"{path}.old-{os.getpid()}"
+            os.rename(path, old_path)
+            os.rename(tmp_path, path)
+            shutil.rmtree(old_path, ignore_errors=True)
+        else:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    return path
+
+
+# =======================
+# Đọc / ghi artifact
+# =======================
+def _entry_dir(kind, key):
+    return os.path.join(CACHE_DIR, f"v{CACHE_VERSION}", f"{kind}-{key[:20]}")
+
+
+def load_artifacts(kind, key, mmap_mode=None):
+    """
+    Đọc artifact đã lưu cho (kind, key)
+
+    Với mmap_mode='r', mọi array (kể cả các thành phần data/indices/indptr
+    của ma trận sparse) được memory-map read-only: các process cùng máy
+    dùng chung page cache của OS thay vì mỗi process giữ một bản copy.
+
+    Args:
+        kind: Loại artifact (vd: 'content-restaurants-topk', 'cf')
+        key: Fingerprint của nguồn dữ liệu
+        mmap_mode: Truyền cho np.load (vd: 'r' để memory-map)
+
+    Returns:
+        (arrays dict, data dict) hoặc None nếu chưa có / bị hỏng
+    """
+    path = _entry_dir(kind, key)
+    meta_path = os.path.join(path, "meta.json")
+
+    if not os.path.exists(meta_path):
+        return None
+
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        def _load(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+
+        arrays = {}
+        for name, fmt in meta["arrays"].items():
+            if fmt == "sparse":
+                arrays[name] = csr_matrix(
+                    (_load(f"{name}.data"), _load(f"{name}.indices"), _load(f"{name}.indptr")),
+                    shape=tuple(meta["shapes"][name]),
+                    copy=False
+                )
+            else:
+                arrays[name] = _load(name)
+
+        return arrays, meta["data"]
+
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_artifacts(kind, key, arrays, data=None):
+    """
+    Ghi artifact cho (kind, key) (xem write_bundle) rồi xóa các entry cũ
+    cùng kind
+
+    Args:
+        kind: Loại artifact
+        key: Fingerprint của nguồn dữ liệu
+        arrays: Dict tên → np.ndarray hoặc scipy.sparse matrix
+        data: Dict dữ liệu JSON-serializable (vocabularies, ids dạng chuỗi...)
+
+    Returns:
+        True nếu ghi thành công
+    """
+    final_path = _entry_dir(kind, key)
+
+    files = {}
+    formats = {}
+    shapes = {}
+    for name, value in arrays.items():
+        if issparse(value):
+            # Lưu từng thành phần CSR thành .npy riêng để có thể memory-map
+            value = value.tocsr()
+            files[f"{name}.data"] = value.data
+            files[f"{name}.indices"] = value.indices
+            files[f"{name}.indptr"] = value.indptr
+            formats[name] = "sparse"
+            shapes[name] = list(value.shape)
+        else:
+            files[name] = value
+            formats[name] = "dense"
+
+    try:
+        # Process khác đã ghi cùng key -> giữ bản đó
+        write_bundle(final_path, files, {"arrays": formats, "shapes": shapes, "data": data or {}},
+                     replace=False)
+    except OSError:
+        return False
+
+    _prune_entries(kind, keep=final_path)
+    return True
+
+
+def _prune_entries(kind, keep):
+    """
+    Xóa các entry cũ của cùng kind (nguồn dữ liệu đã thay đổi)
+    """
+    version_dir = os.path.dirname(keep)
+
+    for entry in os.listdir(version_dir):
+        path = os.path.join(version_dir, entry)
+        if path == keep or ".tmp-" in entry:
+            continue
+        if entry.rsplit("-", 1)[0] == kind:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+# =======================
+# Shared catalog store
+# =======================
+def share_numeric_columns(df, kind, key):
+    """
+    Thay các cột số của DataFrame bằng array memory-map read-only
+    (lưu vào cache nếu chưa có), để các process dùng chung page cache
+
+    Args:
+        df: DataFrame catalog
+        kind: Loại artifact (vd: 'catalog-restaurants_with_coords')
+        key: Fingerprint của nguồn dữ liệu
+
+    Returns:
+        DataFrame cùng cột/thứ tự, cột số là np.memmap
+    """
+    numeric_cols = df.select_dtypes(include="number").columns
+
+    cached = load_artifacts(kind, key, mmap_mode="r")
+    if cached is None:
+        save_artifacts(kind, key, {col: df[col].to_numpy() for col in numeric_cols})
+        cached = load_artifacts(kind, key, mmap_mode="r")
+
+    if cached is None:
+        # Không ghi được cache (vd: thư mục read-only) -> dùng bản trong RAM
+        return df
+
+    shared, _ = cached
+    return pd.DataFrame(
+        {col: shared[col] if col in shared else df[col] for col in df.columns},
+        index=df.index,
+        copy=False
+    )
+
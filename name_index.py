@@ -0,0 +1,152 @@
+# name_index.py
+import re
+import unicodedata
+
+import numpy as np
+
+
+# =======================
+# Chuẩn hóa tên
+# =======================
+def normalize_name(text):
+    """
+    Chuẩn hóa tên quán để tìm kiếm: bỏ dấu tiếng Việt (đ -> d),
+    casefold, gộp khoảng trắng
+
+    Vd: "Bún Mắm  Cô Ba" -> "bun mam co ba"
+    """
+    text = unicodedata.normalize('NFD', str(text))
+    text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+    text = text.replace('đ', 'd').replace('Đ', 'D').casefold()
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+# =======================
+# Name index
+# =======================
+class NameIndex:
+    """
+    Index tên quán dựng một lần lúc load:
+    - keys: các tên đã chuẩn hóa (không trùng), sort tăng dần
+    - key_rows: với mỗi key, các vị trí dòng có tên đó
+    - trie: mỗi node là (dict ký tự -> node con, [lo, hi)) với [lo, hi) là
+      đoạn keys có prefix tương ứng (keys đã sort nên các key cùng prefix
+      nằm liền nhau)
+
+    Tra cứu chính xác và theo prefix đều đi theo trie: O(độ dài query),
+    cộng số kết quả trả về.
+    """
+
+    def __init__(self, keys, key_rows, children, ranges):
+        self.keys = keys
+        self.key_rows = key_rows
+        self.children = children
+        self.ranges = ranges
+
+    @classmethod
+    def build(cls, names):
+        """
+        Dựng NameIndex từ danh sách tên theo thứ tự dòng (vd: X['name'])
+        """
+        rows_by_key = {}
+        for row, name in enumerate(names):
+            rows_by_key.setdefault(normalize_name(name), []).append(row)
+
+        keys = sorted(rows_by_key)
+        key_rows = [np.array(rows_by_key[key], dtype=np.int32) for key in keys]
+
+        children = [{}]
+        ranges = [[0, len(keys)]]
+        for i, key in enumerate(keys):
+            node = 0
+            for ch in key:
+                child = children[node].get(ch)
+                if child is None:
+                    child = len(children)
+                    children[node][ch] = child
+                    children.append({})
+                    ranges.append([i, i])
+                ranges[child][1] = i + 1
+                node = child
+
+        return cls(keys, key_rows, children, ranges)
+
+    def _walk(self, key):
+        """
+        Node của trie ứng với key, None nếu không có tên nào bắt đầu bằng key
+        """
+        node = 0
+        for ch in key:
+            node = self.children[node].get(ch)
+            if node is None:
+                return None
+        return node
+
+    def lookup(self, name):
+        """
+        Các vị trí dòng có tên trùng name (không phân biệt hoa thường / dấu)
+
+        Returns:
+            np.ndarray int32 (rỗng nếu không tìm thấy)
+        """
+        key = normalize_name(name)
+        node = self._walk(key)
+
+        if node is not None:
+            lo = self.ranges[node][0]
+            # Key ngắn nhất trong đoạn (đứng đầu) là chính key nếu có
+            if lo < len(self.keys) and self.keys[lo] == key:
+                return self.key_rows[lo]
+
+        return np.array([], dtype=np.int32)
+
+    def prefix(self, query, limit=10):
+        """
+        Các vị trí dòng có tên bắt đầu bằng query (autocomplete),
+        theo thứ tự tên đã chuẩn hóa
+
+        Args:
+            query: Chuỗi người dùng nhập (có dấu hay không đều được)
+            limit: Số kết quả tối đa
+
+        Returns:
+            List vị trí dòng
+        """
+        node = self._walk(normalize_name(query))
+        if node is None:
+            return []
+
+        lo, hi = self.ranges[node]
+        rows = []
+        for i in range(lo, hi):
+            rows.extend(self.key_rows[i].tolist())
+            if len(rows) >= limit:
+                break
+
+        return rows[:limit]
+
+
+def find_row(names_index, names, name):
+    """
+    Vị trí dòng của quán có tên name: ưu tiên tên trùng khớp hoàn toàn,
+    sau đó trùng khi bỏ qua hoa thường / dấu. None nếu không có
+
+    Args:
+        names_index: NameIndex
+        names: Tên quán theo thứ tự dòng (để phân biệt các tên cùng key)
+        name: Tên cần tìm
+    """
+    rows = names_index.lookup(name)
+    if len(rows) == 0:
+        return None
+
+    for row in rows:
+        if names[row] == name:
+            return int(row)
+
+    lowered = str(name).lower()
+    for row in rows:
+        if str(names[row]).lower() == lowered:
+            return int(row)
+
+    return int(rows[0])
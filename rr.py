@@ -1,11 +1,12 @@
 # app.py
 import itertools
+from datetime import datetime
 
 import streamlit as st
 import json
 import pandas as pd
 import matplotlib.pyplot as plt
-from Content_based_Filtering_model import load_and_prepare_data, build_similarity_model,get_recommendations
+from Content_based_Filtering_model import load_content_model, get_recommendations, SIMILARITY_MODE
 
 # =======================
 # Cấu hình Streamlit
@@ -19,11 +20,9 @@ st.set_page_config(
 # =======================
 # Tải dữ liệu & mô hình
 # =======================
-@st.cache_data
+@st.cache_resource
 def load_data():
-    X = load_and_prepare_data("./restaurants.json")
-    cosine_sim = build_similarity_model(X)
-    return X, cosine_sim
+    return load_content_model("./restaurants.json", mode=SIMILARITY_MODE)
 
 X, cosine_sim = load_data()
 
@@ -58,6 +57,7 @@ st.sidebar.image("logo.svg")
 selected_district = st.sidebar.selectbox("Choose your District", districts, index=0)
 selected_category = st.sidebar.selectbox("Choose your favorite food", food_categories, index=0)
 selected_restaurant = st.sidebar.selectbox("Choose your favorite Restaurant", restaurants, index=0)
+open_now = st.sidebar.checkbox("Only restaurants open now")
 
 # =======================
 # Tiêu đề & mô tả
@@ -91,20 +91,26 @@ if st.sidebar.button("Show recommendations"):
     if selected_category != "--- Chọn món yêu thích ---":
         st.subheader(f"🍜 Các quán có món: **{selected_category}**")
 
-        # Cách 1: Nếu food_categories là list
-        res_list_have_selected_category = X[
-            X['food_categories'].apply(
-                lambda lst: selected_category in lst if isinstance(lst, list) else False
-            )
-        ]
+        open_at = datetime.now() if open_now else None
+
+        # Cách 1: Nếu food_categories là list (bitset dựng sẵn trong model, lọc cả quận)
+        selected_mask = cosine_sim.filters.mask(
+            food_categories=[selected_category],
+            district=[selected_district] if selected_district != "--- Chọn quận ---" else None,
+            open_at=open_at
+        )
+        res_list_have_selected_category = X[selected_mask]
 
         # Cách 2: Nếu food_categories là string (dự phòng)
         if res_list_have_selected_category.empty:
-            res_list_have_selected_category = X[
-                X['food_categories'].astype(str).str.contains(selected_category, case=False, na=False)
-            ]
-
-        # Lọc thêm theo quận nếu có
+            fallback_mask = X['food_categories'].astype(str).str.contains(
+                selected_category, case=False, na=False
+            ).to_numpy()
+            if open_at is not None:
+                fallback_mask &= cosine_sim.filters.mask(open_at=open_at)
+            res_list_have_selected_category = X[fallback_mask]
+
+        # Lọc thêm theo quận nếu có (đã lọc sẵn ở cách 1)
         if selected_district != "--- Chọn quận ---":
             res_list_have_selected_category = res_list_have_selected_category[
                 res_list_have_selected_category['district'] == selected_district